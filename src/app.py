@@ -1,5 +1,11 @@
 #!/usr/bin/env python
+import asyncio
+import time
+from functools import wraps
+from typing import AsyncIterator
+
 from telegram import ReplyKeyboardRemove, ReplyKeyboardMarkup, Update
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -18,12 +24,17 @@ from src.tools.image import generate_image
 from src.constants import PERSIST_DIR
 
 TELEGRAM_TOKEN = get_secret("TELEGRAM_TOKEN")
+STREAM_RESPONSES = True
+STREAM_EDIT_INTERVAL = 1.5
+MAX_MESSAGE_LENGTH = 4096
 filterwarnings("ignore")
 logger = BaseLogger(__name__)
 options, chat, research = range(3)
 options_keyboard = [["Chat", "Research"]]
 options_markup = ReplyKeyboardMarkup(options_keyboard, one_time_keyboard=True)
 chat_engine = ChatEngine(chat_mode="condense_plus_context")
+# the reply being generated for each user, kept out of user_data since tasks can't be persisted
+pending_replies = {}
 
 
 def reset_state(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -33,12 +44,64 @@ def reset_state(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     context.user_data["chat_engine"] = ChatEngine(chat_mode="condense_plus_context", user_id=user_id)
 
 
-async def send_message_in_chunks(update: Update, message: str, chunk_size: int = 4096) -> None:
+async def send_message_in_chunks(update: Update, message: str, chunk_size: int = MAX_MESSAGE_LENGTH) -> None:
     """Send a large message in chunks."""
     for i in range(0, len(message), chunk_size):
         await update.message.reply_text(message[i : i + chunk_size])
 
 
+async def send_message_streaming(update: Update, tokens: AsyncIterator[str], edit_interval: float = STREAM_EDIT_INTERVAL) -> None:
+    """Send a placeholder message and progressively edit it as tokens arrive, throttled to the edit interval."""
+    message = await update.message.reply_text("...", reply_markup=ReplyKeyboardRemove())
+    text, sent_text, last_edit = "", "", time.monotonic()
+
+    async def send(new_text: str) -> None:
+        nonlocal message
+        if message is None:
+            message = await update.message.reply_text(new_text)
+            return
+        try:
+            await message.edit_text(new_text)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+
+    async for token in tokens:
+        text += token
+        # fill the current message and carry the rest over, a new message is only sent once it has visible text
+        while len(text) > MAX_MESSAGE_LENGTH:
+            if text[:MAX_MESSAGE_LENGTH].strip():
+                await send(text[:MAX_MESSAGE_LENGTH])
+            text, message, sent_text, last_edit = text[MAX_MESSAGE_LENGTH:], None, "", time.monotonic()
+        if text.strip() and (message is None or time.monotonic() - last_edit >= edit_interval):
+            await send(text)
+            sent_text, last_edit = text, time.monotonic()
+
+    if text.strip() and text != sent_text:
+        await send(text)
+
+
+def cancellable(handler):
+    """Let /cancel stop a non-blocking handler while it generates a reply, ending the conversation."""
+
+    @wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        user_id, task = update.effective_user.id, asyncio.current_task()
+        pending_replies[user_id] = task
+        try:
+            return await handler(update, context)
+        except asyncio.CancelledError:
+            # only a cancel requested by the user ends the conversation, others are propagated
+            if pending_replies.get(user_id) is task:
+                raise
+            return ConversationHandler.END
+        finally:
+            if pending_replies.get(user_id) is task:
+                del pending_replies[user_id]
+
+    return wrapper
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Starts the conversation"""
 
@@ -51,6 +114,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return options
 
 
+@cancellable
 async def chat_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """A chat handler that replies to the user's query"""
     user = update.message.from_user
@@ -59,9 +123,13 @@ async def chat_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
     if user_query == options_keyboard[0][0]:
         response = """I'm here, what's on your mind?"""
+    elif STREAM_RESPONSES:
+        chat_engine = context.user_data.get("chat_engine")
+        await send_message_streaming(update, chat_engine.astream(user_query))
+        return chat
     else:
         chat_engine = context.user_data.get("chat_engine")
-        response = chat_engine.chat(user_query)
+        response = await chat_engine.achat(user_query)
 
     await update.message.reply_text(
         response,
@@ -71,6 +139,7 @@ async def chat_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     return chat
 
 
+@cancellable
 async def research_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """A research handler that does research on the user's topic of interest"""
     user_query = update.message.text
@@ -80,7 +149,8 @@ async def research_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             f"Now conducting research on the topic: {user_query}.",
             reply_markup=ReplyKeyboardRemove(),
         )
-        response = str(ResearchTeam().crew().kickoff(inputs={"topic": user_query}))
+        crew = ResearchTeam().crew()
+        response = str(await asyncio.to_thread(crew.kickoff, inputs={"topic": user_query}))
         await send_message_in_chunks(update, response)
 
         context.user_data["has_research_topic"] = False
@@ -108,6 +178,19 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return ConversationHandler.END
 
 
+async def cancel_reply(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Cancels the reply being generated and ends the conversation."""
+    task = pending_replies.pop(update.effective_user.id, None)
+    if task is not None:
+        task.cancel()
+    await cancel(update, context)
+
+
+async def still_thinking(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Answers updates received while a reply is being generated, which the conversation doesn't handle."""
+    await update.message.reply_text("Still working on your last message, send /cancel to stop.")
+
+
 async def agent_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Switch chat engine character based on user input."""
     message = update.message.text
@@ -135,23 +218,28 @@ def main() -> None:
     persistence = PicklePersistence(filepath=f"{PERSIST_DIR}/.conversations")
     application = Application.builder().token(TELEGRAM_TOKEN).persistence(persistence).build()
 
+    # handlers awaiting the models don't block, so that other users' updates are handled meanwhile
     application.add_handler(CommandHandler("agent", agent_handler))
-    application.add_handler(CommandHandler("image", image_handler))
+    application.add_handler(CommandHandler("image", image_handler, block=False))
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
             options: [
-                MessageHandler(filters.Regex(f"^({options_keyboard[0][0]})$"), chat_handler),
-                MessageHandler(filters.Regex(f"^({options_keyboard[0][1]})$"), research_handler),
+                MessageHandler(filters.Regex(f"^({options_keyboard[0][0]})$"), chat_handler, block=False),
+                MessageHandler(filters.Regex(f"^({options_keyboard[0][1]})$"), research_handler, block=False),
             ],
             chat: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, chat_handler),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, chat_handler, block=False),
+            ],
+            research: [MessageHandler(filters.TEXT & ~filters.COMMAND, research_handler, block=False)],
+            ConversationHandler.WAITING: [
+                CommandHandler("cancel", cancel_reply),
+                MessageHandler(filters.TEXT, still_thinking),
             ],
-            research: [MessageHandler(filters.TEXT & ~filters.COMMAND, research_handler)],
         },
         fallbacks=[
             CommandHandler("cancel", cancel),
-            CommandHandler("research", research_handler),
+            CommandHandler("research", research_handler, block=False),
         ],
     )
     application.add_handler(conv_handler)
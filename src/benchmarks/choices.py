@@ -0,0 +1,76 @@
+"""
+Benchmarks grammar-constrained multiple choice sampling against free sampling with retries.
+
+    python -m src.benchmarks.choices --trials 20
+"""
+
+import random
+import time
+
+import click
+
+from concordia.language_model.language_model import InvalidResponseError
+
+from src.models.completion import SimulationModelAdapter
+from src.utils.logger import BaseLogger
+
+logger = BaseLogger(__name__)
+
+QUESTIONS = [
+    (
+        "Alice has been insulted by Bob at the town market. What does Alice do next?",
+        ["confront Bob", "walk away", "ask the crowd for support", "laugh it off"],
+    ),
+    (
+        "The harvest failed and the granary is half empty. What should the village elder announce?",
+        ["rationing", "a feast", "a trade expedition", "nothing"],
+    ),
+    ("A stranger offers to buy the tavern at twice its value. How does the owner respond?", ["accept", "refuse", "negotiate"]),
+]
+
+
+def measure(name: str, adapter: SimulationModelAdapter, trials: int, seed: int = 42) -> None:
+    generate = adapter.model.generate
+    calls = 0
+
+    def counting_generate(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        return generate(*args, **kwargs)
+
+    adapter.model.generate = counting_generate
+    # every mode starts cold, so that no mode is sped up by the prefixes an earlier one evaluated
+    adapter.model.reset_cache()
+    rng = random.Random(seed)
+    latencies, failures = [], 0
+    for _ in range(trials):
+        question, options = rng.choice(QUESTIONS)
+        labels = [chr(ord("a") + i) for i in range(len(options))]
+        prompt = question + "\n" + "\n".join(f"({label}) {option}" for label, option in zip(labels, options))
+        start = time.perf_counter()
+        try:
+            adapter.sample_choice(prompt, labels)
+        except InvalidResponseError:
+            failures += 1
+        latencies.append(time.perf_counter() - start)
+    adapter.model.generate = generate
+
+    latencies.sort()
+    logger.info(
+        f"{name}: {calls / trials:.2f} calls per choice, {failures} of {trials} failed, "
+        f"p50 {latencies[len(latencies) // 2]:.3f}s, p95 {latencies[int(len(latencies) * 0.95)]:.3f}s"
+    )
+
+
+@click.command()
+@click.option("--trials", type=int, default=20)
+def main(trials: int):
+    adapter = SimulationModelAdapter()
+    # each mode runs first once, as well as starting from a cold cache
+    for constrained in (False, True, True, False):
+        adapter.constrained = constrained
+        measure("grammar constrained" if constrained else "free sampling", adapter, trials)
+
+
+if __name__ == "__main__":
+    main()
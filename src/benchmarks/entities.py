@@ -0,0 +1,50 @@
+"""
+Benchmarks entity extraction throughput on the cpu, comparing the llama-index EntityExtractor
+against the batched, quantized and sharded CPUEntityExtractor. The baseline needs the
+llama-index-extractor-entity package.
+
+    python -m src.benchmarks.entities --sample_size 5 --num_processes 2
+"""
+
+import asyncio
+import time
+
+import click
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.extractors.entity import EntityExtractor
+
+from src.processors.entities import CPUEntityExtractor
+from src.processors.loaders import PDFLoader
+from src.utils.logger import BaseLogger
+
+logger = BaseLogger(__name__)
+
+
+def measure(name: str, extractor, nodes: list) -> list:
+    start = time.perf_counter()
+    metadata = asyncio.run(extractor.aextract(nodes))
+    elapsed = time.perf_counter() - start
+    entities = sum(len(m.get("entities", [])) for m in metadata)
+    logger.info(f"{name}: {len(nodes) / elapsed:.2f} nodes/sec, {entities} entities, {elapsed:.1f}s for {len(nodes)} nodes")
+    return metadata
+
+
+@click.command()
+@click.option("--sample_size", type=int, default=5)
+@click.option("--batch_size", type=int, default=16)
+@click.option("--num_processes", type=int, default=2)
+def main(sample_size: int, batch_size: int, num_processes: int):
+    documents = PDFLoader().load_data(sample_size=sample_size, randomize=True)
+    nodes = SentenceSplitter(chunk_size=512, chunk_overlap=16).get_nodes_from_documents(documents)
+
+    baseline = measure("EntityExtractor, per node", EntityExtractor(device="cpu"), nodes)
+    for quantize in (False, True):
+        extractor = CPUEntityExtractor(batch_size=batch_size, quantize=quantize, num_processes=num_processes)
+        metadata = measure(f"CPUEntityExtractor, {'int8' if quantize else 'fp32'}", extractor, nodes)
+        extractor.close()
+        agreement = sum(set(a.get("entities", [])) == set(b.get("entities", [])) for a, b in zip(baseline, metadata))
+        logger.info(f"{agreement} of {len(nodes)} nodes have the same entities as the baseline")
+
+
+if __name__ == "__main__":
+    main()
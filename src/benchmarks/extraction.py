@@ -0,0 +1,56 @@
+"""
+Benchmarks the combined title and keyword extractor against the separate keyword and title extractors.
+
+    python -m src.benchmarks.extraction --sample_size 5
+"""
+
+import asyncio
+import time
+
+import click
+from llama_index.callbacks import CallbackManager, TokenCountingHandler
+from llama_index.extractors import KeywordExtractor
+from llama_index.text_splitter import SentenceSplitter
+
+from src.models.completion import LlamaCPPModelAdapter
+from src.processors.extractor import SUMMARIZATION_PROMPT, CustomTitleExtractor, TitleKeywordExtractor
+from src.processors.loaders import PDFLoader
+from src.utils.logger import BaseLogger
+
+logger = BaseLogger(__name__)
+
+
+async def measure(name: str, extractors: list, nodes: list, counter: TokenCountingHandler) -> None:
+    counter.reset_counts()
+    start = time.perf_counter()
+    for extractor in extractors:
+        await extractor.aextract(nodes)
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"{name}: {len(counter.llm_token_counts)} llm calls, {counter.prompt_llm_token_count} prompt tokens, "
+        f"{counter.completion_llm_token_count} completion tokens, {elapsed:.1f}s for {len(nodes)} nodes"
+    )
+
+
+@click.command()
+@click.option("--sample_size", type=int, default=5)
+@click.option("--keywords", type=int, default=5)
+@click.option("--pack_size", type=int, default=4)
+def main(sample_size: int, keywords: int, pack_size: int):
+    counter = TokenCountingHandler()
+    llm = LlamaCPPModelAdapter().model
+    llm.callback_manager = CallbackManager([counter])
+
+    documents = PDFLoader().load_data(sample_size=sample_size, randomize=True)
+    nodes = SentenceSplitter(chunk_size=512, chunk_overlap=16).get_nodes_from_documents(documents)
+
+    separate = [KeywordExtractor(keywords=keywords, llm=llm), CustomTitleExtractor(llm=llm, prompt=SUMMARIZATION_PROMPT)]
+    asyncio.run(measure("keyword + title extractors", separate, nodes, counter))
+    combined = [TitleKeywordExtractor(llm=llm, keywords=keywords, pack_size=1)]
+    asyncio.run(measure("combined extractor", combined, nodes, counter))
+    packed = [TitleKeywordExtractor(llm=llm, keywords=keywords, pack_size=pack_size)]
+    asyncio.run(measure(f"combined extractor, packing {pack_size}", packed, nodes, counter))
+
+
+if __name__ == "__main__":
+    main()
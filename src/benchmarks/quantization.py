@@ -0,0 +1,123 @@
+"""
+Benchmarks quantized candidate search with exact rescoring against brute force float32 search,
+measuring the resident memory each takes in a fresh process and the disk the quantized sidecar adds
+next to the collection's float32 embeddings.
+
+    python -m src.benchmarks.quantization --collection research --k 5
+"""
+
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+import numpy as np
+import psutil
+from chromadb import PersistentClient
+
+from src.constants import PERSIST_DIR
+from src.utils.logger import BaseLogger
+from src.vector_stores import QUANTIZATION_MODES, QuantizedIndex, rescore
+
+logger = BaseLogger(__name__)
+
+
+def load_embeddings(collection_name: str, batch_size: int = 1000) -> tuple[list[str], np.ndarray]:
+    collection = PersistentClient(path=PERSIST_DIR).get_collection(collection_name)
+    ids, embeddings = [], []
+    for offset in range(0, collection.count(), batch_size):
+        batch = collection.get(limit=batch_size, offset=offset, include=["embeddings"])
+        ids.extend(batch["ids"])
+        embeddings.extend(batch["embeddings"])
+    return ids, np.asarray(embeddings, dtype=np.float32)
+
+
+def recall_at_k(expected: list[set], found: list[list]) -> float:
+    return float(np.mean([len(e & set(f)) / len(e) for e, f in zip(expected, found)]))
+
+
+def rss() -> int:
+    return psutil.Process().memory_info().rss
+
+
+def disk_size(path: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def search_float32(embeddings_path: str, queries: np.ndarray, k: int) -> tuple[int, list[list[int]]]:
+    """Brute force search over the float32 matrix, returning the RSS it took and the positions found."""
+    before = rss()
+    embeddings = np.load(embeddings_path)
+    normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    found = []
+    for q in queries:
+        scores = normalized @ normalized[q]
+        scores[q] = -np.inf
+        found.append(list(np.argsort(-scores)[:k]))
+    return rss() - before, found
+
+
+def search_quantized(
+    persist_dir: str, mode: str, query_ids: list[str], query_vectors: np.ndarray, k: int, oversample: int
+) -> tuple[int, list[list[str]], list[list[str]]]:
+    """Search a persisted quantized index, returning the RSS it took and the ids found before and after rescoring."""
+    before = rss()
+    index = QuantizedIndex(mode=mode, persist_dir=persist_dir)
+    index.load()
+    quantized, rescored = [], []
+    for query_id, query in zip(query_ids, query_vectors):
+        candidates = [c for c in index.search(query, k * oversample + 1) if c != query_id]
+        quantized.append(candidates[:k])
+        similarities = rescore(query, index.vectors(candidates))
+        rescored.append([candidates[i] for i in np.argsort(-similarities)[:k]])
+    return rss() - before, quantized, rescored
+
+
+def in_fresh_process(fn, *args):
+    """Run fn in a new interpreter, so that its RSS isn't shared with what the benchmark already loaded."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(fn, *args).result()
+
+
+@click.command()
+@click.option("--collection", type=str, default="research")
+@click.option("--k", type=int, default=5)
+@click.option("--oversample", type=int, default=4)
+@click.option("--n_queries", type=int, default=200)
+@click.option("--seed", type=int, default=42)
+def main(collection: str, k: int, oversample: int, n_queries: int, seed: int):
+    ids, embeddings = load_embeddings(collection)
+    logger.info(f"Loaded {len(ids)} embeddings of dimension {embeddings.shape[1]} from {collection}")
+
+    # held out queries: each query's own vector is excluded from its results
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(len(ids), size=min(n_queries, len(ids)), replace=False)
+    query_ids = [ids[q] for q in queries]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        embeddings_path = os.path.join(tmp_dir, "embeddings.npy")
+        np.save(embeddings_path, embeddings)
+        full_rss, found = in_fresh_process(search_float32, embeddings_path, queries, k)
+        expected = [{ids[i] for i in positions} for positions in found]
+        logger.info(f"float32: {full_rss / 2**20:.2f} MiB RSS")
+
+        for mode in QUANTIZATION_MODES:
+            persist_dir = os.path.join(tmp_dir, mode)
+            index = QuantizedIndex(mode=mode, persist_dir=persist_dir)
+            for start in range(0, len(ids), index.chunk_size):
+                index.add(ids[start : start + index.chunk_size], embeddings[start : start + index.chunk_size])
+            mode_rss, quantized, rescored = in_fresh_process(
+                search_quantized, persist_dir, mode, query_ids, embeddings[queries], k, oversample
+            )
+            mode_disk = disk_size(persist_dir)
+            logger.info(
+                f"{mode}: {mode_rss / 2**20:.2f} MiB RSS ({1 - mode_rss / full_rss:.1%} saved), "
+                f"{mode_disk / 2**20:.2f} MiB on disk ({mode_disk / embeddings.nbytes:.1%} of the float32 embeddings), "
+                f"recall@{k} {recall_at_k(expected, quantized):.3f} quantized, "
+                f"{recall_at_k(expected, rescored):.3f} rescored from {k * oversample} candidates"
+            )
+
+
+if __name__ == "__main__":
+    main()
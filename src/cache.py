@@ -0,0 +1,403 @@
+"""
+Caches that sit in front of the models and data sources.
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Hashable, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+    MessageRole,
+)
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.llms import LLM
+
+from src.utils.logger import BaseLogger
+
+logger = BaseLogger(__name__)
+
+
+class SemanticCache:
+    """
+    A response cache keyed by query embeddings.
+
+    A lookup hits when a cached query in the same namespace is within the cosine `threshold`
+    of the new one. Entries expire after `ttl` seconds and the least recently used entry is
+    evicted once the cache holds `max_size` entries.
+    """
+
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        threshold: float = 0.95,
+        ttl: float = 24 * 60 * 60,
+        max_size: int = 1024,
+    ):
+        self.embed_model = embed_model
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def embed(self, query: str) -> np.ndarray:
+        embedding = np.asarray(self.embed_model.get_query_embedding(query), dtype=np.float32)
+        return embedding / (np.linalg.norm(embedding) or 1.0)
+
+    def lookup(self, embedding: np.ndarray, namespace: Hashable) -> Optional[str]:
+        """Return the cached response closest to the embedding, if it is within the threshold."""
+        with self._lock:
+            self._expire()
+            keys = [k for k in self._entries if k[0] == namespace]
+            if keys:
+                similarities = np.stack([self._entries[k][0] for k in keys]) @ embedding
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.hits += 1
+                    self._entries.move_to_end(keys[best])
+                    return self._entries[keys[best]][1]
+            self.misses += 1
+            return None
+
+    def store(self, embedding: np.ndarray, response: str, namespace: Hashable) -> None:
+        with self._lock:
+            self._entries[(namespace, embedding.tobytes())] = (embedding, response, time.monotonic())
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, namespace: Hashable = None) -> None:
+        """Drop the entries of a namespace, or every entry when no namespace is given."""
+        with self._lock:
+            for key in [k for k in self._entries if namespace is None or k[0] == namespace]:
+                del self._entries[key]
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        for key in [k for k, (_, _, created) in self._entries.items() if now - created > self.ttl]:
+            del self._entries[key]
+
+
+class EmbeddingCache:
+    """
+    A persistent cache of embeddings keyed by (model name, content hash), stored in SQLite.
+    """
+
+    def __init__(self, persist_path: str):
+        self._lock = Lock()
+        self._conn = sqlite3.connect(persist_path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                PRIMARY KEY (model, hash)
+            ) WITHOUT ROWID;
+            """
+        )
+
+    def get_many(self, model: str, hashes: Sequence[str], batch_size: int = 500) -> dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), batch_size):
+                batch = hashes[start : start + batch_size]
+                rows = self._conn.execute(
+                    f"SELECT hash, embedding FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                    (model, *batch),
+                ).fetchall()
+                found.update({h: np.frombuffer(e, dtype=np.float32).tolist() for h, e in rows})
+        return found
+
+    def put_many(self, model: str, embeddings: dict[str, List[float]]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                [(model, h, np.asarray(e, dtype=np.float32).tobytes()) for h, e in embeddings.items()],
+            )
+
+
+class CachedResponse(NamedTuple):
+    content: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+class HTTPCache:
+    """
+    A persistent cache of HTTP response bodies with their validators, stored in SQLite, so that
+    refetches can be made conditional on the ETag and Last-Modified headers.
+    """
+
+    def __init__(self, persist_path: str):
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._conn = sqlite3.connect(persist_path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                content BLOB NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+            """
+        )
+
+    @property
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / requests if requests else 0.0}
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        with self._lock:
+            row = self._conn.execute("SELECT content, etag, last_modified FROM responses WHERE url = ?", (url,)).fetchone()
+        return CachedResponse(*row) if row else None
+
+    def validators(self, url: str) -> dict:
+        """The conditional request headers for a cached url."""
+        cached = self.get(url)
+        headers = {}
+        if cached and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+        return headers
+
+    def put(self, url: str, content: bytes, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (url, etag, last_modified, content, time.time()),
+            )
+
+
+class CompletionCache:
+    """
+    A persistent cache of deterministic completions keyed by (model, prompt, generation params),
+    stored in SQLite. The least recently used entries are evicted once it holds `max_size` entries.
+    """
+
+    def __init__(self, persist_path: str, max_size: int = 100_000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._conn = sqlite3.connect(persist_path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                completion TEXT NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used);
+            """
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    @staticmethod
+    def key(model: str, prompt: str, **params) -> str:
+        payload = json.dumps({"model": model, "prompt": prompt, "params": params}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT completion FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE completions SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, completion: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?)", (key, completion, time.time()))
+            self._conn.execute(
+                """
+                DELETE FROM completions WHERE key IN (
+                    SELECT key FROM completions ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_size,),
+            )
+
+
+class CachedLLM(LLM):
+    """
+    Wraps an LLM so that its completions and chat responses are answered from a CompletionCache
+    when the same request was made before. Only wrap LLMs that sample greedily, so that a cached
+    response is the one the model would give again. Streams are cached once consumed to the end.
+    """
+
+    llm: LLM = Field(description="The wrapped LLM.")
+    model_key: str = Field(description="Identifies the model and its generation params in cache keys.")
+    _cache: CompletionCache = PrivateAttr()
+
+    def __init__(self, llm: LLM, cache: CompletionCache, model_key: str, **kwargs: Any):
+        # prompts are formatted by this wrapper as the wrapped LLM would format them
+        super().__init__(
+            llm=llm,
+            model_key=model_key,
+            system_prompt=llm.system_prompt,
+            messages_to_prompt=llm.messages_to_prompt,
+            completion_to_prompt=llm.completion_to_prompt,
+            output_parser=llm.output_parser,
+            pydantic_program_mode=llm.pydantic_program_mode,
+            query_wrapper_prompt=llm.query_wrapper_prompt,
+            **kwargs,
+        )
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return self.llm.metadata
+
+    @property
+    def cache(self) -> CompletionCache:
+        return self._cache
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        key = self._complete_key(prompt, formatted, kwargs)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return CompletionResponse(text=cached)
+        response = self.llm.complete(prompt, formatted=formatted, **kwargs)
+        self._cache.put(key, response.text)
+        return response
+
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        key = self._complete_key(prompt, formatted, kwargs)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return CompletionResponse(text=cached)
+        response = await self.llm.acomplete(prompt, formatted=formatted, **kwargs)
+        self._cache.put(key, response.text)
+        return response
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        key = self._complete_key(prompt, formatted, kwargs)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return iter([CompletionResponse(text=cached, delta=cached)])
+        return self._cache_stream(key, self.llm.stream_complete(prompt, formatted=formatted, **kwargs))
+
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        key = self._complete_key(prompt, formatted, kwargs)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return self._replay(CompletionResponse(text=cached, delta=cached))
+        return self._acache_stream(key, await self.llm.astream_complete(prompt, formatted=formatted, **kwargs))
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        key = self._chat_key(messages, kwargs)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return self._chat_response(cached)
+        response = self.llm.chat(messages, **kwargs)
+        self._cache.put(key, response.message.content or "")
+        return response
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        key = self._chat_key(messages, kwargs)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return self._chat_response(cached)
+        response = await self.llm.achat(messages, **kwargs)
+        self._cache.put(key, response.message.content or "")
+        return response
+
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        key = self._chat_key(messages, kwargs)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return iter([self._chat_response(cached, delta=cached)])
+        return self._cache_stream(key, self.llm.stream_chat(messages, **kwargs))
+
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        key = self._chat_key(messages, kwargs)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return self._replay(self._chat_response(cached, delta=cached))
+        return self._acache_stream(key, await self.llm.astream_chat(messages, **kwargs))
+
+    def _complete_key(self, prompt: str, formatted: bool, params: dict) -> str:
+        return CompletionCache.key(self.model_key, prompt, formatted=formatted, **params)
+
+    def _chat_key(self, messages: Sequence[ChatMessage], params: dict) -> str:
+        prompt = json.dumps([m.model_dump(mode="json") for m in messages], sort_keys=True)
+        return CompletionCache.key(self.model_key, prompt, chat=True, **params)
+
+    @staticmethod
+    def _chat_response(text: str, delta: Optional[str] = None) -> ChatResponse:
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=text), delta=delta)
+
+    @staticmethod
+    def _text(response: Any) -> str:
+        return response.message.content or "" if isinstance(response, ChatResponse) else response.text
+
+    def _cache_stream(self, key: str, stream):
+        response = None
+        for response in stream:
+            yield response
+        if response is not None:
+            self._cache.put(key, self._text(response))
+
+    async def _acache_stream(self, key: str, stream):
+        response = None
+        async for response in stream:
+            yield response
+        if response is not None:
+            self._cache.put(key, self._text(response))
+
+    @staticmethod
+    async def _replay(response: Any):
+        yield response
@@ -1,15 +1,25 @@
+import asyncio
+from typing import AsyncIterator, Iterator, Optional
+
+import numpy as np
+from llama_index.core.chat_engine import CondensePlusContextChatEngine, ContextChatEngine
+from llama_index.core.llms import ChatMessage, MessageRole
 from llama_index.core.memory import ChatSummaryMemoryBuffer
-from llama_index.core.storage.chat_store import SimpleChatStore
 
 from src.models.completion import LlamaCPPModelAdapter
 from src.models.embeddings import EmbeddingModelAdapter
+from src.registry import registry
 from src.storage import Storage
 from src.utils.logger import StreamingLogger
 from src.prompts import personas
-from src.constants import PERSIST_DIR
-from src.constants import R1_MODEL_PATH
+from src.constants import CHAT_CONCURRENCY, R1_MODEL_PATH
+from src.utils.concurrency import backend_metrics, backend_semaphore
 
 logger = StreamingLogger(__name__)
+RETRIEVAL_CHAT_ENGINES = {
+    "context": ContextChatEngine,
+    "condense_plus_context": CondensePlusContextChatEngine,
+}
 
 
 class ChatEngine:
@@ -20,33 +30,50 @@ class ChatEngine:
         verbose: bool = False,
         **kwargs,
     ):
-        self.index = self._load_index(index_name)
+        self.index_name = index_name
         self.chat_mode = chat_mode
         self.persona = kwargs.get("persona", "casper")
+        self.user_id = kwargs.get("user_id", "")
+        self.use_cache = kwargs.get("use_cache", True)
         self.verbose = verbose
-        try:
-            self.chat_store = SimpleChatStore.from_persist_path(persist_path=f"{PERSIST_DIR}/chat_store.json")
-        except Exception as e:
-            logger.warning(f"Error loading chat store: {e}")
-            self.chat_store = SimpleChatStore()
+        self._setup()
+
+    def _setup(self):
+        """Take shared handles from the registry and build the session's engine."""
+        self.index = registry.get_index(self.index_name)
+        self.chat_store = registry.get_chat_store()
+        self.cache = registry.get_response_cache()
         self.buffer = ChatSummaryMemoryBuffer.from_defaults(
             token_limit=4096,
-            chat_store_key=kwargs.get("user_id", ""),
+            chat_store_key=self.user_id,
             chat_store=self.chat_store,
         )
         self.engine = self._get_engine()
 
-    def _load_index(self, index_name: str):
-        """Load the appropriate index based on the index_name."""
-        llm = LlamaCPPModelAdapter().model
-        emb = EmbeddingModelAdapter().model
-        storage = Storage(llm=llm, embed_model=emb)
-        if index_name == "research":
-            return storage.load_research_index()
-        return storage.load_vector_index()
+    def __getstate__(self):
+        """Persist only the session configuration, the shared handles are rebuilt on load."""
+        return {
+            "index_name": self.index_name,
+            "chat_mode": self.chat_mode,
+            "persona": self.persona,
+            "user_id": self.user_id,
+            "use_cache": self.use_cache,
+            "verbose": self.verbose,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._setup()
 
     def _get_engine(self):
-        """Initialize the chat engine."""
+        """Initialize the chat engine, retrieving context with the hybrid retriever where the mode needs it."""
+        if self.chat_mode in RETRIEVAL_CHAT_ENGINES:
+            return RETRIEVAL_CHAT_ENGINES[self.chat_mode].from_defaults(
+                retriever=registry.get_storage().hybrid_retriever(self.index),
+                verbose=self.verbose,
+                system_prompt=personas.get(self.persona),
+                memory=self.buffer,
+            )
         return self.index.as_chat_engine(
             chat_mode=self.chat_mode,
             verbose=self.verbose,
@@ -55,9 +82,81 @@ class ChatEngine:
         )
 
     def chat(self, user_query: str) -> str:
-        response = self.engine.chat(user_query)
-        self.chat_store.persist(persist_path=f"{PERSIST_DIR}/chat_store.json")
-        return str(response)
+        embedding, cached = self._lookup_cache(user_query)
+        if cached is not None:
+            return cached
+        response = str(self.engine.chat(user_query))
+        self._persist(embedding, response)
+        return response
+
+    def stream(self, user_query: str) -> Iterator[str]:
+        """Yield the response tokens as they are generated."""
+        embedding, cached = self._lookup_cache(user_query)
+        if cached is not None:
+            yield cached
+            return
+        response = self.engine.stream_chat(user_query)
+        yield from response.response_gen
+        self._persist(embedding, response.response)
+
+    async def achat(self, user_query: str) -> str:
+        embedding, cached = await asyncio.to_thread(self._lookup_cache, user_query)
+        if cached is not None:
+            return cached
+        async with self._slot():
+            response = str(await self.engine.achat(user_query))
+        await asyncio.to_thread(self._persist, embedding, response)
+        return response
+
+    async def astream(self, user_query: str) -> AsyncIterator[str]:
+        """Yield the response tokens as they are generated, without blocking the event loop."""
+        embedding, cached = await asyncio.to_thread(self._lookup_cache, user_query)
+        if cached is not None:
+            yield cached
+            return
+        async with self._slot():
+            response = await self.engine.astream_chat(user_query)
+            async for token in response.async_response_gen():
+                yield token
+        await asyncio.to_thread(self._persist, embedding, response.response)
+
+    def _slot(self):
+        """Hold a slot of the llm backend, bounding the concurrent generations across all sessions sharing it."""
+        llm = registry.get_llm()
+        # a cached llm is keyed by the backend it wraps
+        llm = getattr(llm, "llm", llm)
+        backend = getattr(llm, "api_base", None) or getattr(llm, "model_path", None) or type(llm).__name__
+        # the server runs a generation per slot, an in-process model one at a time
+        limit = CHAT_CONCURRENCY if getattr(llm, "api_base", None) else 1
+        return backend_metrics(backend).track(backend_semaphore(backend, limit=limit))
+
+    def _cache_namespace(self) -> tuple:
+        """Cached answers are only shared between sessions with the same persona and index version."""
+        return (self.persona, self.index_name, registry.get_storage().version)
+
+    def _lookup_cache(self, user_query: str) -> tuple[Optional[np.ndarray], Optional[str]]:
+        """
+        Look up a cached answer to a near-identical query, recording a hit in the session's memory. Only
+        the opening query of a session is cached, later ones depend on the history they follow.
+        """
+        if not self.use_cache or self.buffer.get_all():
+            return None, None
+        embedding = self.cache.embed(user_query)
+        cached = self.cache.lookup(embedding, self._cache_namespace())
+        if cached is not None:
+            self.buffer.put(ChatMessage(role=MessageRole.USER, content=user_query))
+            self.buffer.put(ChatMessage(role=MessageRole.ASSISTANT, content=cached))
+            self.chat_store.persist(self.user_id)
+        return embedding, cached
+
+    def _persist(self, embedding: Optional[np.ndarray], response: str) -> None:
+        """Persist the session's new messages and cache the response, both block on disk."""
+        self.chat_store.persist(self.user_id)
+        self._store_cache(embedding, response)
+
+    def _store_cache(self, embedding: Optional[np.ndarray], response: str) -> None:
+        if embedding is not None and response:
+            self.cache.store(embedding, response, self._cache_namespace())
 
     def update_engine(self, chat_mode: str = None, persona: str = None):
         """Update configuration dynamically."""
@@ -5,3 +5,8 @@ RESEARCH_DIR = "src/data/.research"
 
 MISTRAL_MODEL_PATH = f"./{MODEL_DIR}/mistral-7b-instruct-v0.2.Q3_K_S.gguf"
 R1_MODEL_PATH = f"./{MODEL_DIR}/deepseek_r1.gguf"
+
+# the number of parallel slots the local llama.cpp server is started with, i.e. --parallel
+LLM_SERVER_SLOTS = 4
+CHAT_CONCURRENCY = LLM_SERVER_SLOTS
+VECTOR_QUANTIZATION = None
@@ -1,6 +1,9 @@
+import time
+
 import torch
 import click
-from llama_cpp import Llama
+import llama_cpp
+from llama_cpp import Llama, LlamaRAMCache
 from src.constants import MISTRAL_MODEL_PATH
 
 
@@ -15,13 +18,28 @@ model = Llama(
     n_gpu_layers=50,
     verbose=False,
 )
+# every round repeats the base prompt, reuse its evaluated state instead of evaluating it again
+model.set_cache(LlamaRAMCache(capacity_bytes=2 << 30))
+
+
+def generate(prompt: str, **kwargs) -> dict:
+    llama_cpp.llama_reset_timings(model.ctx)
+    start = time.perf_counter()
+    output = model(prompt, **kwargs)
+    timings = llama_cpp.llama_get_timings(model.ctx)
+    click.secho(
+        f"{output['usage']['prompt_tokens']} prompt tokens, {timings.n_p_eval} evaluated in {timings.t_p_eval_ms / 1000:.2f}s, "
+        f"{timings.n_eval} generated in {timings.t_eval_ms / 1000:.2f}s, {time.perf_counter() - start:.2f}s total",
+        fg="cyan",
+    )
+    return output
 
 
 @click.command()
 @click.option("--n_rounds", type=int, default=5)
 def main(n_rounds: int):
     base_prompt = "Imagine: A roast battle between comedians Andrew Schulz, Kevin Hart and Whitney Cummings. Be true to each character and their causes. Be short, impactful and crisp."
-    output = model(
+    output = generate(
         f"<s>[INST] {base_prompt} [/INST]",
         max_tokens=256,
         stop=["</s>"],
@@ -37,7 +55,7 @@ def main(n_rounds: int):
             base_prompt
             + f"Responses in the previous round {response} for context. Now based on this, in the next round, get racier, juicier,  take em down, let's go!"
         )
-        output = model(
+        output = generate(
             f"<s>[INST] {prompt} [/INST]",
             max_tokens=1024,
             stop=["</s>"],
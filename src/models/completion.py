@@ -1,5 +1,14 @@
+import json
 import re
-from llama_cpp import Llama
+import time
+from functools import lru_cache
+from threading import Lock
+from typing import AsyncGenerator, Iterator, Optional
+
+import httpx
+import llama_cpp
+from llama_cpp import Llama, LlamaGrammar, LlamaRAMCache
+from llama_index.core.base.llms.types import CompletionResponse
 from llama_index.llms.llama_cpp import LlamaCPP
 from llama_index.llms.openai import OpenAI
 from llama_index.llms.llama_cpp.llama_utils import (
@@ -7,7 +16,9 @@ from llama_index.llms.llama_cpp.llama_utils import (
     messages_to_prompt,
 )
 from concordia.language_model.language_model import LanguageModel, InvalidResponseError
-from src.constants import MISTRAL_MODEL_PATH
+from src.cache import CachedLLM, CompletionCache
+from src.constants import LLM_SERVER_SLOTS, MISTRAL_MODEL_PATH
+from src.utils.concurrency import LoopLocalTransport, backend_metrics, backend_semaphore
 from src.utils.logger import BaseLogger
 from src.utils.secrets import get_secret
 
@@ -17,6 +28,25 @@ LOCAL_API_KEY = get_secret("LOCAL_API_KEY")
 
 logger = BaseLogger(__name__)
 
+_http_clients = {}
+_http_clients_lock = Lock()
+
+
+def shared_http_clients(host: str, max_connections: int = 2 * LLM_SERVER_SLOTS) -> tuple[httpx.Client, httpx.AsyncClient]:
+    """
+    The sync and async http clients shared by every adapter of a host, so they share one connection pool.
+    The async client pools connections per running loop, as they can't outlive the loop that opened them.
+    """
+    with _http_clients_lock:
+        if host not in _http_clients:
+            limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            timeout = httpx.Timeout(600.0, connect=10.0)
+            _http_clients[host] = (
+                httpx.Client(limits=limits, timeout=timeout),
+                httpx.AsyncClient(timeout=timeout, transport=LoopLocalTransport(limits=limits)),
+            )
+        return _http_clients[host]
+
 
 class LlamaCPPModelAdapter:
     """
@@ -33,8 +63,13 @@ class LlamaCPPModelAdapter:
         model_kwargs: dict = {"n_gpu_layers": 60},
         system_prompt: str = "",
         server: bool = True,
+        completion_cache: CompletionCache = None,
     ):
+        self._model_key = LOCAL_HOST if server else model_path
+        # the in-process model runs one generation at a time, the server one per slot
+        self._slots = LLM_SERVER_SLOTS if server else 1
         if server:
+            http_client, async_http_client = shared_http_clients(LOCAL_HOST)
             self._model = OpenAI(
                 api_base=LOCAL_HOST,
                 api_key=LOCAL_API_KEY,
@@ -42,6 +77,8 @@ class LlamaCPPModelAdapter:
                 messages_to_prompt=messages_to_prompt,
                 completion_to_prompt=completion_to_prompt,
                 system_prompt=system_prompt,
+                http_client=http_client,
+                async_http_client=async_http_client,
             )
         else:
             self._model = LlamaCPP(
@@ -56,16 +93,89 @@ class LlamaCPPModelAdapter:
                 verbose=False,
                 system_prompt=system_prompt,
             )
+        # completions are only reproducible, and so cacheable, when sampling greedily
+        if completion_cache is not None and temperature == 0.0:
+            params = {
+                "model": self._model_key,
+                "max_new_tokens": max_new_tokens,
+                "system_prompt": system_prompt,
+                "generate_kwargs": generate_kwargs,
+            }
+            model_key = json.dumps(params, sort_keys=True, default=str)
+            self._model = CachedLLM(self._model, cache=completion_cache, model_key=model_key)
 
     @property
     def model(self):
         return self._model
 
+    @property
+    def completion_cache(self) -> Optional[CompletionCache]:
+        return self._model.cache if isinstance(self._model, CachedLLM) else None
+
+    @property
+    def queue_metrics(self) -> dict:
+        """Queue wait and service times of the async requests to this adapter's backend."""
+        return backend_metrics(self._model_key).stats
+
     def generate(self, prompt: str, streaming: bool = False, **kwargs) -> str:
+        context_str = kwargs.get("context_str", "")
         if streaming:
-            return self.model.stream_complete(prompt, context_str=kwargs.get("context_str", ""))
-        else:
-            return str(self.model.complete(prompt, context_str=kwargs.get("context_str", "")))
+            return self.model.stream_complete(prompt, context_str=context_str)
+        return str(self.model.complete(prompt, context_str=context_str))
+
+    async def agenerate(self, prompt: str, **kwargs) -> str:
+        """Generate a completion, waiting for a free slot of the backend."""
+        context_str = kwargs.get("context_str", "")
+        async with self._track():
+            return str(await self.model.acomplete(prompt, context_str=context_str))
+
+    async def astream(self, prompt: str, **kwargs) -> AsyncGenerator[CompletionResponse, None]:
+        """Stream a completion, holding a slot of the backend until the stream ends."""
+        context_str = kwargs.get("context_str", "")
+        async with self._track():
+            async for response in await self.model.astream_complete(prompt, context_str=context_str):
+                yield response
+
+    def _track(self):
+        return backend_metrics(self._model_key).track(backend_semaphore(self._model_key, self._slots))
+
+
+_local_models = {}
+_local_models_lock = Lock()
+
+
+def shared_llama(
+    repo_id: str,
+    filename: str,
+    n_ctx: int = 8192,
+    n_gpu_layers: int = 60,
+    prefix_cache_bytes: int = 2 << 30,
+    **kwargs,
+) -> tuple[Llama, Lock]:
+    """
+    The process-wide model for (repo_id, filename, n_ctx, n_gpu_layers), loaded on first use with
+    memory mapped weights, and the lock serializing access to it. Other kwargs, such as the chat
+    format, take effect from the first load.
+    """
+    key = (repo_id, filename, n_ctx, n_gpu_layers)
+    with _local_models_lock:
+        if key not in _local_models:
+            start = time.perf_counter()
+            model = Llama.from_pretrained(
+                repo_id=repo_id,
+                filename=filename,
+                n_ctx=n_ctx,
+                n_gpu_layers=n_gpu_layers,
+                use_mmap=True,
+                **kwargs,
+            )
+            if prefix_cache_bytes:
+                # the saved states are looked up by longest token prefix, so calls sharing instructions,
+                # memories or a base prompt restore its evaluated state and only process the new suffix
+                model.set_cache(LlamaRAMCache(capacity_bytes=prefix_cache_bytes))
+            _local_models[key] = (model, Lock())
+            logger.info(f"Loaded {repo_id}/{filename} in {time.perf_counter() - start:.1f}s")
+        return _local_models[key]
 
 
 class LLamaModelAdapter:
@@ -76,22 +186,33 @@ class LLamaModelAdapter:
         n_gpu_layers: int = 60,
         chat_format: str = "chatml",
         verbose: bool = False,
+        prefix_cache_bytes: int = 2 << 30,
+        n_ctx: int = 8192,
         **kwargs,
     ):
-        self._model = Llama.from_pretrained(
+        self._model, self._lock = shared_llama(
             repo_id=repo_id,
             filename=filename,
+            n_ctx=n_ctx,
             n_gpu_layers=n_gpu_layers,
+            prefix_cache_bytes=prefix_cache_bytes,
             chat_format=chat_format,
             verbose=verbose,
-            n_ctx=8192,
             **kwargs,
         )
+        self.last_timings = {}
 
     @property
     def model(self):
         return self._model
 
+    def reset_cache(self) -> None:
+        """Drop the evaluated prompt and the cached prefixes of the shared model, so the next prompt is evaluated cold."""
+        with self._lock:
+            self.model.reset()
+            if self.model.cache is not None:
+                self.model.cache.cache_state.clear()
+
     def generate(
         self,
         messages: list[dict[str, str]],
@@ -101,25 +222,51 @@ class LLamaModelAdapter:
         streaming: bool = False,
         **kwargs,
     ) -> str:
-        response = self.model.create_chat_completion(
+        # always stream internally, so that prompt evaluation and generation can be timed apart
+        chunks = self._stream(
             messages=messages,
-            stream=streaming,
             temperature=temperature,
             stop=stop,
             max_tokens=max_tokens,
             **kwargs,
         )
         if streaming:
-            return response
+            return chunks
         else:
-            return response.get("choices", [])[0].get("message", {}).get("content")
+            return "".join(chunk["choices"][0]["delta"].get("content", "") for chunk in chunks)
+
+    def _stream(self, **kwargs) -> Iterator[dict]:
+        """Stream a chat completion, holding the shared model until the stream ends."""
+        with self._lock:
+            llama_cpp.llama_reset_timings(self.model.ctx)
+            start = time.perf_counter()
+            first = None
+            for chunk in self.model.create_chat_completion(stream=True, **kwargs):
+                first = first or time.perf_counter()
+                yield chunk
+            end = time.perf_counter()
+            timings = llama_cpp.llama_get_timings(self.model.ctx)
+        self.last_timings = {
+            "prompt_eval_s": (first or end) - start,
+            "generation_s": end - (first or end),
+            "prompt_tokens_evaluated": timings.n_p_eval,
+            "generated_tokens": timings.n_eval,
+        }
+        logger.debug(f"Timings: {self.last_timings}")
+
+
+@lru_cache(maxsize=256)
+def choice_grammar(responses: tuple[str, ...]) -> LlamaGrammar:
+    """A GBNF grammar that only accepts one of the responses, verbatim."""
+    return LlamaGrammar.from_string(f"root ::= {' | '.join(json.dumps(r) for r in responses)}", verbose=False)
 
 
 class SimulationModelAdapter(LanguageModel):
     """A model adapter for concordia model simulations."""
 
-    def __init__(self, **kwargs) -> None:
+    def __init__(self, constrained: bool = True, **kwargs) -> None:
         self._model = LLamaModelAdapter(**kwargs)
+        self.constrained = constrained
 
     @property
     def model(self):
@@ -138,10 +285,15 @@ class SimulationModelAdapter(LanguageModel):
         return response
 
     def sample_choice(self, prompt: str, responses: list[str], max_attempts: int = 10) -> tuple[int, str, dict[str, float]]:
-        max_characters = len(max(responses, key=len))
+        prompt = prompt + "\nRespond EXACTLY with one of the following options:\n" + "\n".join(responses) + "."
+        if self.constrained:
+            try:
+                return self.__sample_constrained_choice(prompt, responses)
+            except ValueError as e:
+                logger.warning(f"Constrained choice failed, falling back to free sampling: {e}")
 
+        max_characters = len(max(responses, key=len))
         attempts = 1
-        prompt = prompt + "\nRespond EXACTLY with one of the following options:\n" + "\n".join(responses) + "."
 
         for _ in range(max_attempts):
             temperature = 0.0
@@ -165,6 +317,19 @@ class SimulationModelAdapter(LanguageModel):
 
         raise InvalidResponseError("Too many multiple choice attempts.")
 
+    def __sample_constrained_choice(self, prompt: str, responses: list[str]) -> tuple[int, str, dict[str, float]]:
+        """Sample a choice in one short greedy decode, with a grammar that only admits the responses."""
+        longest = max(responses, key=len)
+        max_tokens = len(self.model.model.tokenize(longest.encode("utf-8"), add_bos=False)) + 2
+        sample = self.model.generate(
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.0,
+            max_tokens=max_tokens,
+            grammar=choice_grammar(tuple(responses)),
+        )
+        idx = responses.index(sample.strip())
+        return idx, responses[idx], {}
+
     def __extract_choice_response(self, sample: str) -> str | None:
         if len(sample) == 1:
             return sample
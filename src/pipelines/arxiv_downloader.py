@@ -1,22 +1,93 @@
 import os
+import re
+import sqlite3
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set, Union
+
+from arxiv import Result, SortOrder
+
 from src.processors.connectors import ArxivConnector
 from src.utils.logger import BaseLogger
-from typing import List, Set
 
 logger = BaseLogger(__name__)
 
+DATE_FORMAT = "%Y%m%d%H%M"
+
+
+def arxiv_id(article: Result) -> str:
+    """The versionless arXiv ID, so that revisions of a paper are recognized as the same paper."""
+    return re.sub(r"v\d+$", "", article.get_short_id())
+
+
+class ArxivLedger:
+    """
+    A persistent SQLite ledger of downloaded arXiv IDs and the last submitted date fetched per topic.
+    """
+
+    def __init__(self, persist_path: str):
+        os.makedirs(os.path.dirname(persist_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(persist_path)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS articles (
+                id TEXT PRIMARY KEY,
+                title TEXT,
+                source TEXT,
+                published TEXT,
+                downloaded_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS topics (topic TEXT PRIMARY KEY, last_submitted TEXT NOT NULL);
+            """
+        )
+
+    def seen(self, ids: Iterable[str]) -> Set[str]:
+        ids = list(ids)
+        if not ids:
+            return set()
+        rows = self._conn.execute(f"SELECT id FROM articles WHERE id IN ({','.join('?' * len(ids))})", ids)
+        return {row[0] for row in rows}
+
+    def record(self, articles: List[Result], source: str) -> None:
+        now = datetime.now(timezone.utc).isoformat()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO articles VALUES (?, ?, ?, ?, ?)",
+                [(arxiv_id(a), a.title, source, a.published.isoformat(), now) for a in articles],
+            )
+
+    def high_water_mark(self, topic: str) -> Optional[datetime]:
+        row = self._conn.execute("SELECT last_submitted FROM topics WHERE topic = ?", (topic,)).fetchone()
+        return datetime.fromisoformat(row[0]) if row else None
+
+    def advance(self, topic: str, submitted: datetime) -> None:
+        with self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO topics VALUES (?, ?)
+                ON CONFLICT (topic) DO UPDATE SET last_submitted = MAX(last_submitted, excluded.last_submitted)
+                """,
+                (topic, submitted.isoformat()),
+            )
+
 
 class DailyArxivDownloader:
     def __init__(
         self,
-        topic: str,
+        topics: Union[List[str], str] = None,
         download_dir: str = "src/data/.pdfs",
         manual_ids_file: str = "src/data/.inputs/arxiv.txt",
+        ledger_path: str = "src/data/.inputs/arxiv.db",
+        max_results: int = 5,
+        connector: ArxivConnector = None,
     ):
-        self.topic = topic
+        if isinstance(topics, str):
+            topics = [topics]
+        self.topics = topics or []
         self.download_dir = download_dir
         self.manual_ids_file = manual_ids_file
-        self.connector = ArxivConnector(destination_path=self.download_dir)
+        self.max_results = max_results
+        self.connector = connector or ArxivConnector(destination_path=self.download_dir)
+        self.ledger = ArxivLedger(ledger_path)
 
     def _read_manual_ids(self) -> Set[str]:
         """Read manually added arxiv IDs from file."""
@@ -36,29 +107,77 @@ class DailyArxivDownloader:
         for article in articles:
             logger.info(f"Downloaded {source} article: {article.title} (ID: {article.entry_id})")
 
+    def _download_new(self, articles: List[Result], source: str) -> Dict[str, Result]:
+        """Download the articles missing from the ledger, returning the failed ones by ID."""
+        seen = self.ledger.seen(arxiv_id(a) for a in articles)
+        new = list({arxiv_id(a): a for a in articles if arxiv_id(a) not in seen}.values())
+        logger.info(f"{len(new)} of {len(articles)} {source} articles are new")
+        if not new:
+            return {}
+
+        paths = self.connector.download_articles(new)
+        downloaded = [a for a, path in zip(new, paths) if path is not None]
+        self.ledger.record(downloaded, source)
+        self._log_downloaded_articles(downloaded, source)
+        return {arxiv_id(a): a for a, path in zip(new, paths) if path is None}
+
+    def fetch_topic(self, topic: str) -> None:
+        """Fetch the articles submitted since the last run for a topic, oldest first, a page at a time until caught up."""
+        since = self.ledger.high_water_mark(topic)
+        if since is None:
+            logger.info(f"Fetching trending articles for topic: {topic}")
+            articles = self.connector.get_articles_by_topic(query=topic, max_results=self.max_results, download=False)
+            self._advance(topic, articles, self._download_new(articles, topic))
+            return
+
+        until = datetime.now(timezone.utc).strftime(DATE_FORMAT)
+        while True:
+            logger.info(f"Fetching articles for topic: {topic} submitted since {since}")
+            articles = self.connector.get_articles_by_topic(
+                query=f"({topic}) AND submittedDate:[{since.strftime(DATE_FORMAT)} TO {until}]",
+                max_results=self.max_results,
+                sort_order=SortOrder.Ascending,
+                download=False,
+            )
+            failed = self._download_new(articles, topic)
+            mark = self._advance(topic, articles, failed)
+            # a full page may have more after it, unless a failure holds the mark back or it can't move
+            if len(articles) < self.max_results or failed or mark is None or mark <= since:
+                return
+            since = mark
+
+    def _advance(self, topic: str, articles: List[Result], failed: Dict[str, Result]) -> Optional[datetime]:
+        """Move the topic's mark past the fetched articles, returning the mark moved to."""
+        # don't move past a failed download, so that it is fetched again on the next run
+        submitted = [a.published for a in articles]
+        if failed:
+            submitted = [s for s in submitted if s < min(a.published for a in failed.values())]
+        if not submitted:
+            return None
+        self.ledger.advance(topic, max(submitted))
+        return max(submitted)
+
     def run(self, mode="auto"):
         # Create download directrory if it doesn't exist
         os.makedirs(self.download_dir, exist_ok=True)
 
         if mode == "auto":
-            # Download trending articles
-            logger.info(f"Fetching trending articles for topic: {self.topic}")
-            trending_articles = self.connector.get_articles_by_topic(query=self.topic, max_results=5, download=True)
-            self._log_downloaded_articles(trending_articles, "trending")
+            for topic in self.topics:
+                self.fetch_topic(topic)
 
         # Process manually added IDs
         elif mode == "manual":
             manual_ids = self._read_manual_ids()
             logger.info(f"Found {len(manual_ids)} manually added article IDs")
             if manual_ids:
-                manual_articles = self.connector.get_articles_by_ids(ids=list(manual_ids), download=True)
-                self._log_downloaded_articles(manual_articles, "manual")
+                manual_articles = self.connector.get_articles_by_ids(ids=list(manual_ids), download=False)
+                self._download_new(manual_articles, "manual")
         else:
             logger.error(f"Mode {mode} not supported. Please use 'auto' or 'manual'.")
 
 
 if __name__ == "__main__":
-    # Configure the topic you're interested in
+    # Configure the topics you're interested in
     topics = [
         "reinforcement learning",
         "autonomous vehicles",
@@ -66,8 +185,6 @@ if __name__ == "__main__":
         "information retrieval",
     ]
 
-    for topic in topics:
-        dl = DailyArxivDownloader(topic=topic)
-        dl.run()
-
+    dl = DailyArxivDownloader(topics=topics)
+    dl.run()
     dl.run(mode="manual")
@@ -1,39 +1,70 @@
-import pymupdf4llm
+import os
 import pathlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pymupdf4llm
+from src.utils.incremental import Manifest
 from src.utils.logger import BaseLogger
 
 logger = BaseLogger(__name__)
 
 
+def _convert(pdf_path: str, md_path: str) -> str:
+    """Convert a PDF to markdown, writing to a temporary file that is renamed into place once complete."""
+    md_text = pymupdf4llm.to_markdown(pdf_path)
+    tmp_path = f"{md_path}.tmp"
+    pathlib.Path(tmp_path).write_text(md_text, encoding="utf-8")
+    os.replace(tmp_path, md_path)
+    return md_path
+
+
 class MarkdownConvertor:
     def __init__(
         self,
         input_path: str = "src/data/.pdfs",
         output_path: str = "src/data/.markdowns",
+        num_workers: int = os.cpu_count(),
     ):
         self.input_path = input_path
         self.output_path = output_path
+        self.num_workers = num_workers
+        self.manifest = Manifest(os.path.join(self.output_path, ".manifest.json"))
 
-    def run(self):
+    def run(self, save_every: int = 16):
+        """Convert the PDFs that are new or changed since the last run."""
         logger.info(f"Converting PDFs in {self.input_path} to markdown in {self.output_path}")
+        os.makedirs(self.output_path, exist_ok=True)
 
-        for f in pathlib.Path(self.input_path).iterdir():
-            if f.suffix.lower() == ".pdf":  # Ensure case insensitivity for suffix
-                try:
-                    logger.info(f"Converting {f.name} to markdown")
-
-                    # Convert PDF to markdown
-                    md_text = pymupdf4llm.to_markdown(str(f))  # Ensure f is passed as a string
-
-                    # Define the output markdown file path
-                    md_output_path = pathlib.Path(self.output_path, f.stem + ".md")
+        # Ensure case insensitivity for suffix
+        pdfs = [str(f) for f in pathlib.Path(self.input_path).iterdir() if f.suffix.lower() == ".pdf"]
+        for pdf_path in self.manifest.removed(pdfs):
+            self.manifest.pop(pdf_path)
+        pending = self.manifest.changed(pdfs)
+        for pdf_path in pdfs:
+            entry = self.manifest.get(pdf_path)
+            if pdf_path not in pending and not os.path.exists(entry["output"]):
+                pending[pdf_path] = entry["hash"]
+        logger.info(f"Converting {len(pending)} of {len(pdfs)} PDFs, the rest are unchanged")
 
-                    # Write the markdown content to the file
-                    md_output_path.write_text(md_text, encoding="utf-8")
+        with ProcessPoolExecutor(max_workers=max(1, self.num_workers)) as pool:
+            futures = {pool.submit(_convert, pdf_path, self._output_path(pdf_path)): pdf_path for pdf_path in pending}
+            try:
+                for i, future in enumerate(as_completed(futures), start=1):
+                    pdf_path = futures[future]
+                    try:
+                        md_path = future.result()
+                    except Exception as e:
+                        logger.error(f"Failed to convert {pathlib.Path(pdf_path).name}: {e}")
+                        continue
+                    self.manifest.update(pdf_path, pending[pdf_path], output=md_path)
+                    logger.info(f"Markdown file saved to {md_path}")
+                    if i % save_every == 0:
+                        self.manifest.save()
+            finally:
+                self.manifest.save()
 
-                    logger.info(f"Markdown file saved to {md_output_path}")
-                except Exception as e:
-                    logger.error(f"Failed to convert {f.name}: {e}")
+    def _output_path(self, pdf_path: str) -> str:
+        return str(pathlib.Path(self.output_path, pathlib.Path(pdf_path).stem + ".md"))
 
 
 # Example usage
@@ -1,9 +1,17 @@
+import asyncio
 import os
-from typing import List, Union
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Union
+from urllib.parse import urlparse
 
-from arxiv import Client, Result, Search, SortCriterion
+import aiohttp
+from arxiv import Client, Result, Search, SortCriterion, SortOrder
 from llama_index.core import download_loader
 from llama_index.core import Document
+from bs4 import BeautifulSoup
+from src.cache import HTTPCache
+from src.constants import PERSIST_DIR
 from src.core import Connector
 from src.utils.logger import BaseLogger
 
@@ -21,8 +29,12 @@ class ArxivConnector(Connector):
         page_size: int = 10,
         delay_seconds: float = 10.0,
         num_retries: int = 20,
+        max_downloads: int = 4,
+        download_retries: int = 3,
     ):
         self._source = "arxiv"
+        self.max_downloads = max_downloads
+        self.download_retries = download_retries
         if destination_path:
             os.makedirs(destination_path, exist_ok=True)
         self._destination = destination_path
@@ -50,7 +62,7 @@ class ArxivConnector(Connector):
         else:
             logger.info(f"Found {len(results)} results")
         if download:
-            self._download_articles(results)
+            self.download_articles(results)
         return results
 
     def get_articles_by_topic(
@@ -58,12 +70,14 @@ class ArxivConnector(Connector):
         query: str,
         max_results: int = 5,
         sort_by: SortCriterion = SortCriterion.SubmittedDate,
+        sort_order: SortOrder = SortOrder.Descending,
         download: bool = True,
     ) -> List[Result]:
         search = Search(
             query=query,
             max_results=max_results,
             sort_by=sort_by,
+            sort_order=sort_order,
         )
         results = list(self._client.results(search))
         if len(results) == 0:
@@ -71,11 +85,49 @@ class ArxivConnector(Connector):
         else:
             logger.info(f"Found {len(results)} results")
         if download:
-            self._download_articles(results)
+            self.download_articles(results)
         return results
 
-    def _download_articles(self, articles: List[Result]):
-        return [a.download_pdf(dirpath=self.destination) for a in articles]
+    def download_articles(self, articles: List[Result]) -> List[Optional[str]]:
+        """Download articles concurrently, skipping those already in the destination."""
+        dirpath = self.destination or "./"
+        files = set(os.listdir(dirpath))
+        with ThreadPoolExecutor(max_workers=self.max_downloads) as pool:
+            paths = list(pool.map(lambda a: self._download_article(a, dirpath, files), articles))
+        logger.info(f"Downloaded {sum(p is not None for p in paths)} of {len(articles)} articles to {dirpath}")
+        return paths
+
+    def _download_article(self, article: Result, dirpath: str, files: set) -> Optional[str]:
+        """Download one article to a temporary file and rename it into place once complete."""
+        prefix = f"{article.get_short_id().replace('/', '_')}."
+        for f in files:
+            if f.startswith(prefix) and f.endswith(".pdf") and self._is_complete(os.path.join(dirpath, f)):
+                logger.debug(f"Skipping {article.entry_id}, already downloaded as {f}")
+                return os.path.join(dirpath, f)
+
+        filename = article._get_default_filename()
+        path = os.path.join(dirpath, filename)
+        part_path = f"{path}.part"
+        for attempt in range(self.download_retries):
+            try:
+                article.download_pdf(dirpath=dirpath, filename=os.path.basename(part_path))
+                os.replace(part_path, path)
+                return path
+            except Exception as e:
+                logger.warning(f"Failed to download {article.entry_id} (attempt {attempt + 1}): {e}")
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                if attempt + 1 < self.download_retries:
+                    time.sleep(2**attempt)
+        logger.error(f"Giving up on {article.entry_id} after {self.download_retries} attempts")
+        return None
+
+    @staticmethod
+    def _is_complete(path: str, tail_size: int = 1024) -> bool:
+        """Whether a PDF ends with its end-of-file marker, unlike one truncated by an interrupted download."""
+        with open(path, "rb") as f:
+            f.seek(max(0, os.path.getsize(path) - tail_size))
+            return b"%%EOF" in f.read()
 
 
 class WebConnector(Connector):
@@ -83,10 +135,24 @@ class WebConnector(Connector):
     A connector to text on the web.
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        cache_path: str = os.path.join(PERSIST_DIR, "web_cache.db"),
+        max_connections: int = 32,
+        max_connections_per_host: int = 4,
+        timeout: float = 30.0,
+        web_reader=None,
+    ):
         self._source = "web"
         self._destination = "db"
-        self.web_reader = download_loader("BeautifulSoupWebReader")()
+        self.web_reader = web_reader or download_loader("BeautifulSoupWebReader")()
+        # the reader keeps its site specific extractors private, _parse needs them for pages fetched here
+        self.website_extractor = dict(self.web_reader._website_extractor)
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self.http_cache = HTTPCache(cache_path)
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
 
     @property
     def source(self) -> str:
@@ -96,7 +162,57 @@ class WebConnector(Connector):
     def destination(self) -> str:
         return self._destination
 
-    def get_articles_by_urls(self, urls: Union[List[str], str], custom_hostname: str = None) -> List[Document]:
+    def get_articles_by_urls(
+        self,
+        urls: Union[List[str], str],
+        custom_hostname: str = None,
+        fetch_async: bool = True,
+    ) -> List[Document]:
+        if not isinstance(urls, List):
+            urls = [urls]
+        if not fetch_async:
+            return self.web_reader.load_data(urls=urls, custom_hostname=custom_hostname)
+        return asyncio.run(self.aget_articles_by_urls(urls, custom_hostname=custom_hostname))
+
+    async def aget_articles_by_urls(self, urls: Union[List[str], str], custom_hostname: str = None) -> List[Document]:
+        """Fetch the urls concurrently over a shared connection pool, revalidating cached pages."""
         if not isinstance(urls, List):
             urls = [urls]
-        return self.web_reader.load_data(urls=urls, custom_hostname=custom_hostname)
+        connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.max_connections_per_host)
+        async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
+            documents = await asyncio.gather(*[self._aget_article(session, url, custom_hostname) for url in urls])
+        logger.info(f"Fetched {len(urls)} urls, http cache {self.http_cache.stats}")
+        return list(documents)
+
+    async def _aget_article(self, session: aiohttp.ClientSession, url: str, custom_hostname: str = None) -> Document:
+        try:
+            content = await self._fetch(session, url)
+        except Exception:
+            raise ValueError(f"One of the inputs is not a valid url: {url}")
+        return await asyncio.to_thread(self._parse, content, url, custom_hostname)
+
+    async def _fetch(self, session: aiohttp.ClientSession, url: str) -> bytes:
+        async with session.get(url, headers=self.http_cache.validators(url)) as response:
+            if response.status == 304:
+                cached = self.http_cache.get(url)
+                if cached:
+                    self.http_cache.hits += 1
+                    return cached.content
+            self.http_cache.misses += 1
+            content = await response.read()
+            etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+            if response.status == 200 and (etag or last_modified):
+                self.http_cache.put(url, content, etag=etag, last_modified=last_modified)
+            return content
+
+    def _parse(self, content: bytes, url: str, custom_hostname: str = None) -> Document:
+        """Extract the text as BeautifulSoupWebReader does, using its site specific extractors."""
+        hostname = custom_hostname or urlparse(url).hostname or ""
+        soup = BeautifulSoup(content, "html.parser")
+        extra_info = {"URL": url}
+        if hostname in self.website_extractor:
+            data, metadata = self.website_extractor[hostname](soup=soup, url=url, include_url_in_text=True)
+            extra_info.update(metadata)
+        else:
+            data = soup.getText()
+        return Document(text=data, extra_info=extra_info)
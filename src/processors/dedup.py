@@ -0,0 +1,224 @@
+"""
+Near-duplicate chunk elimination with MinHash signatures and locality sensitive hashing.
+"""
+
+import hashlib
+import re
+import sqlite3
+from threading import Lock
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.schema import BaseNode, MetadataMode, TransformComponent
+
+from src.utils.logger import BaseLogger
+
+logger = BaseLogger(__name__)
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class MinHasher:
+    """
+    Estimates the Jaccard similarity of texts from the minimum hashes of their word shingles.
+    """
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # 31 bit coefficients over 32 bit shingle hashes can't overflow uint64
+        self._a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> set:
+        words = WORD_PATTERN.findall(text.lower())
+        if len(words) <= self.shingle_size:
+            return {" ".join(words)} if words else set()
+        return {" ".join(words[i : i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        shingles = self.shingles(text)
+        if not shingles:
+            return None
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles],
+            dtype=np.uint64,
+        )
+        return ((np.outer(hashes, self._a) + self._b) % MERSENNE_PRIME).min(axis=0)
+
+    @staticmethod
+    def similarity(a: np.ndarray, b: np.ndarray) -> float:
+        return float(np.mean(a == b))
+
+
+class SignatureIndex:
+    """
+    An LSH index of MinHash signatures, persisted in SQLite so that duplicates are found across runs.
+    """
+
+    def __init__(self, persist_path: str, bands: int = 16):
+        self.bands = bands
+        self._lock = Lock()
+        self._conn = sqlite3.connect(persist_path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS signatures (node_id TEXT PRIMARY KEY, source TEXT, signature BLOB NOT NULL);
+            CREATE TABLE IF NOT EXISTS buckets (
+                band INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                node_id TEXT NOT NULL,
+                PRIMARY KEY (band, bucket, node_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS duplicates (
+                source TEXT NOT NULL,
+                duplicate_of TEXT NOT NULL,
+                similarity REAL NOT NULL
+            );
+            """
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
+
+    def _buckets(self, signature: np.ndarray) -> List[tuple[int, str]]:
+        return [
+            (band, hashlib.blake2b(rows.tobytes(), digest_size=8).hexdigest())
+            for band, rows in enumerate(np.array_split(signature, self.bands))
+        ]
+
+    def candidates(self, signature: np.ndarray) -> List[tuple[str, str, np.ndarray]]:
+        """The (node_id, source, signature) of indexed nodes sharing at least one band with the signature."""
+        with self._lock:
+            node_ids = set()
+            for band, bucket in self._buckets(signature):
+                rows = self._conn.execute("SELECT node_id FROM buckets WHERE band = ? AND bucket = ?", (band, bucket))
+                node_ids.update(row[0] for row in rows)
+            if not node_ids:
+                return []
+            rows = self._conn.execute(
+                f"SELECT node_id, source, signature FROM signatures WHERE node_id IN ({','.join('?' * len(node_ids))})",
+                list(node_ids),
+            ).fetchall()
+        return [(node_id, source, np.frombuffer(sig, dtype=np.uint64)) for node_id, source, sig in rows]
+
+    def add(self, node_id: str, source: str, signature: np.ndarray) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO signatures VALUES (?, ?, ?)", (node_id, source, signature.tobytes()))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO buckets VALUES (?, ?, ?)",
+                [(band, bucket, node_id) for band, bucket in self._buckets(signature)],
+            )
+
+    def entries(self) -> List[tuple[str, str, np.ndarray]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT node_id, source, signature FROM signatures").fetchall()
+        return [(node_id, source, np.frombuffer(sig, dtype=np.uint64)) for node_id, source, sig in rows]
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM signatures")
+            self._conn.execute("DELETE FROM buckets")
+
+    def add_duplicate(self, source: str, duplicate_of: str, similarity: float) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO duplicates VALUES (?, ?, ?)", (source, duplicate_of, similarity))
+
+
+class NearDuplicateFilter(TransformComponent):
+    """
+    Drops nodes that are near-duplicates of a node seen in this or an earlier run, so that repeated
+    paper versions and boilerplate are neither extracted from nor embedded twice. Kept nodes of the
+    current run list the sources of the copies collapsed into them under `duplicate_sources`.
+
+    Signatures of kept nodes stay pending until `commit` is called once the nodes are in the vector
+    store, so a run that fails before the upsert doesn't hide its chunks from the next one. Nodes of
+    a source that is reindexed aren't duplicates of that source's earlier chunks.
+    """
+
+    persist_path: str = Field(description="The SQLite file the signatures are persisted to.")
+    threshold: float = Field(default=0.8, description="The estimated Jaccard similarity above which nodes are duplicates.")
+    num_perm: int = Field(default=128, description="The number of MinHash permutations.")
+    bands: int = Field(default=16, description="The number of LSH bands.")
+    shingle_size: int = Field(default=5, description="The number of words per shingle.")
+
+    _hasher: MinHasher = PrivateAttr()
+    _index: SignatureIndex = PrivateAttr()
+    _pending: SignatureIndex = PrivateAttr()
+    _nodes_seen: int = PrivateAttr(default=0)
+    _duplicates: int = PrivateAttr(default=0)
+
+    def __init__(self, persist_path: str, **kwargs: Any):
+        super().__init__(persist_path=persist_path, **kwargs)
+        self._hasher = MinHasher(num_perm=self.num_perm, shingle_size=self.shingle_size)
+        self._index = SignatureIndex(persist_path, bands=self.bands)
+        self._pending = SignatureIndex(":memory:", bands=self.bands)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NearDuplicateFilter"
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "nodes": self._nodes_seen,
+            "duplicates": self._duplicates,
+            "pending": len(self._pending),
+            "indexed": len(self._index),
+        }
+
+    def commit(self) -> None:
+        """Persist the signatures of the nodes kept since the last commit, once they are indexed."""
+        for node_id, source, signature in self._pending.entries():
+            self._index.add(node_id, source, signature)
+        self._pending.clear()
+
+    def __call__(self, nodes: Sequence[BaseNode], **kwargs: Any) -> List[BaseNode]:
+        kept, kept_by_id = [], {}
+        for node in nodes:
+            signature = self._hasher.signature(node.get_content(metadata_mode=MetadataMode.NONE))
+            if signature is None:
+                kept.append(node)
+                continue
+            source = self._source(node)
+            duplicate = self._find_duplicate(signature, source)
+            if duplicate is None:
+                self._pending.add(node.node_id, source, signature)
+                kept.append(node)
+                kept_by_id[node.node_id] = node
+                continue
+
+            duplicate_of, duplicate_source, similarity = duplicate
+            self._index.add_duplicate(source, duplicate_of, similarity)
+            if duplicate_of in kept_by_id:
+                canonical = kept_by_id[duplicate_of]
+                # joined like the entities, as the vector store only takes flat metadata
+                sources = canonical.metadata.get("duplicate_sources", "").split(", ")
+                canonical.metadata["duplicate_sources"] = ", ".join(dict.fromkeys([*filter(None, sources), source]))
+                for excluded in (canonical.excluded_embed_metadata_keys, canonical.excluded_llm_metadata_keys):
+                    if "duplicate_sources" not in excluded:
+                        excluded.append("duplicate_sources")
+            logger.debug(f"Dropping chunk of {source}, {similarity:.2f} similar to a chunk of {duplicate_source}")
+
+        self._nodes_seen += len(nodes)
+        self._duplicates += len(nodes) - len(kept)
+        if len(kept) < len(nodes):
+            logger.info(f"Dropped {len(nodes) - len(kept)} near-duplicate nodes of {len(nodes)}")
+        return kept
+
+    def _find_duplicate(self, signature: np.ndarray, source: str) -> Optional[tuple[str, str, float]]:
+        best = None
+        indexed = [c for c in self._index.candidates(signature) if c[1] != source]
+        for node_id, candidate_source, candidate in indexed + self._pending.candidates(signature):
+            similarity = MinHasher.similarity(signature, candidate)
+            if similarity >= self.threshold and (best is None or similarity > best[2]):
+                best = (node_id, candidate_source, similarity)
+        return best
+
+    @staticmethod
+    def _source(node: BaseNode) -> str:
+        return node.metadata.get("file_name") or node.ref_doc_id or node.node_id
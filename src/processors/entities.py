@@ -0,0 +1,167 @@
+"""
+Entity extraction tuned for CPU-only ingestion nodes.
+"""
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import torch
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.extractors import BaseExtractor
+from llama_index.core.schema import BaseNode
+
+from src.utils.logger import BaseLogger
+
+logger = BaseLogger(__name__)
+
+# the defaults of the llama-index EntityExtractor, which isn't needed to extract entities on the cpu
+DEFAULT_ENTITY_MODEL = "tomaarsen/span-marker-mbert-base-multinerd"
+DEFAULT_ENTITY_MAP = {
+    "PER": "persons",
+    "ORG": "organizations",
+    "LOC": "locations",
+    "ANIM": "animals",
+    "BIO": "biological",
+    "CEL": "celestial",
+    "DIS": "diseases",
+    "EVE": "events",
+    "FOOD": "foods",
+    "INST": "instruments",
+    "MEDIA": "media",
+    "PLANT": "plants",
+    "MYTH": "mythological",
+    "TIME": "times",
+    "VEHI": "vehicles",
+}
+
+_model = None
+
+
+def load_model(model_name: str, quantize: bool = True, num_threads: int = None) -> Any:
+    """Load a SpanMarker model on the cpu, with its linear layers dynamically quantized to int8."""
+    # imported on use, so that importing the extractor doesn't require span_marker
+    from span_marker import SpanMarkerModel
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    model = SpanMarkerModel.from_pretrained(model_name).to("cpu").eval()
+    if quantize:
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def _init_worker(model_name: str, quantize: bool, num_threads: int) -> None:
+    global _model
+    _model = load_model(model_name, quantize=quantize, num_threads=num_threads)
+
+
+def _predict(words: List[List[str]], batch_size: int) -> List[List[Dict]]:
+    with torch.inference_mode():
+        return _model.predict(words, batch_size=batch_size)
+
+
+class CPUEntityExtractor(BaseExtractor):
+    """
+    Extracts `entities` like the llama-index EntityExtractor, but runs batched inference with an
+    int8 quantized SpanMarker model, sharded across worker processes that each load the model once.
+    """
+
+    model_name: str = Field(default=DEFAULT_ENTITY_MODEL, description="The SpanMarker model to use.")
+    prediction_threshold: float = Field(default=0.5, description="The confidence threshold for accepting predictions.")
+    span_joiner: str = Field(default=" ", description="The separator between entity names.")
+    label_entities: bool = Field(default=False, description="Include entity class labels or not.")
+    entity_map: Dict[str, str] = Field(default_factory=dict, description="Mapping of entity class names to usable names.")
+    batch_size: int = Field(default=16, description="The number of nodes per forward pass.")
+    quantize: bool = Field(default=True, description="Quantize the linear layers to int8.")
+    num_processes: int = Field(default=1, description="The number of worker processes to shard nodes across.")
+
+    _tokenizer: Callable = PrivateAttr()
+    _model: Any = PrivateAttr(default=None)
+    _pool: Optional[ProcessPoolExecutor] = PrivateAttr(default=None)
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_ENTITY_MODEL,
+        prediction_threshold: float = 0.5,
+        span_joiner: str = " ",
+        label_entities: bool = False,
+        entity_map: Optional[Dict[str, str]] = None,
+        batch_size: int = 16,
+        quantize: bool = True,
+        num_processes: int = max(1, (os.cpu_count() or 1) // 4),
+        tokenizer: Optional[Callable[[str], List[str]]] = None,
+        **kwargs: Any,
+    ):
+        super().__init__(
+            model_name=model_name,
+            prediction_threshold=prediction_threshold,
+            span_joiner=span_joiner,
+            label_entities=label_entities,
+            entity_map={**DEFAULT_ENTITY_MAP, **(entity_map or {})},
+            batch_size=batch_size,
+            quantize=quantize,
+            num_processes=num_processes,
+            **kwargs,
+        )
+        if tokenizer is None:
+            from nltk.tokenize import word_tokenize
+
+            tokenizer = word_tokenize
+        self._tokenizer = tokenizer
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CPUEntityExtractor"
+
+    async def aextract(self, nodes: Sequence[BaseNode]) -> List[Dict]:
+        words = [self._tokenizer(node.get_content(metadata_mode=self.metadata_mode)) for node in nodes]
+        indices = [i for i, w in enumerate(words) if w]
+        shards = [indices[start : start + self.batch_size] for start in range(0, len(indices), self.batch_size)]
+
+        spans = [[] for _ in nodes]
+        results = await asyncio.gather(*[self._apredict([words[i] for i in shard]) for shard in shards])
+        for shard, shard_spans in zip(shards, results):
+            for i, node_spans in zip(shard, shard_spans):
+                spans[i] = node_spans
+        return [self._to_metadata(node_spans) for node_spans in spans]
+
+    def close(self) -> None:
+        """Shut down the worker processes."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    async def _apredict(self, words: List[List[str]]) -> List[List[Dict]]:
+        if self.num_processes <= 1:
+            if self._model is None:
+                self._model = load_model(self.model_name, quantize=self.quantize)
+            return await asyncio.to_thread(self._predict_inline, words)
+        return await asyncio.wrap_future(self._get_pool().submit(_predict, words, self.batch_size))
+
+    def _predict_inline(self, words: List[List[str]]) -> List[List[Dict]]:
+        with torch.inference_mode():
+            return self._model.predict(words, batch_size=self.batch_size)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # split the cores between the workers so their intra-op threads don't oversubscribe the cpu
+            num_threads = max(1, (os.cpu_count() or 1) // self.num_processes)
+            logger.info(f"Starting {self.num_processes} entity workers with {num_threads} threads each")
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.num_processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_name, self.quantize, num_threads),
+            )
+        return self._pool
+
+    def _to_metadata(self, spans: List[Dict]) -> Dict[str, List[str]]:
+        metadata = {}
+        for span in spans:
+            if span["score"] > self.prediction_threshold:
+                label = self.entity_map.get(span["label"], span["label"]) if self.label_entities else "entities"
+                metadata.setdefault(label, set()).add(self.span_joiner.join(span["span"]))
+        return {label: list(entities) for label, entities in metadata.items()}
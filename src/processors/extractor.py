@@ -1,17 +1,25 @@
+import hashlib
+import json
 import os
-from typing import Dict, List, Sequence
+from functools import partial
+from typing import Awaitable, Callable, Dict, List, Sequence
 
-from llama_index.async_utils import run_jobs
-from llama_index.bridge.pydantic import Field
+import torch
+from llama_index.core.async_utils import run_jobs
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.extractors import BaseExtractor, KeywordExtractor
+from llama_index.core.ingestion import IngestionPipeline
+from llama_index.core.llms import LLM
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.prompts import PromptTemplate
+from llama_index.core.schema import BaseNode, Document, MetadataMode, TextNode
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.extractors import BaseExtractor, EntityExtractor, KeywordExtractor
-from llama_index.ingestion import IngestionPipeline
-from llama_index.llm_predictor.base import LLMPredictorType
-from llama_index.prompts import PromptTemplate
-from llama_index.schema import BaseNode, Document, TextNode
-from llama_index.text_splitter import SentenceSplitter
+from src.cache import EmbeddingCache
 from src.constants import PERSIST_DIR
+from src.processors.dedup import NearDuplicateFilter
+from src.processors.entities import CPUEntityExtractor
 from src.storage import Storage
+from src.utils.concurrency import AdaptiveConcurrencyLimiter
 from src.utils.logger import BaseLogger
 
 
@@ -22,40 +30,177 @@ Dont include descriptions of what you are doing, such as this document summarize
 
 Title: [/INST]
 """
+TITLE_KEYWORDS_PROMPT = """<s>[INST] Passages:
+{context_str}
+
+For each numbered passage above, generate a highly concise title that summarizes \
+the unique themes found in the passage, in no more than 20 words, and {keywords} unique keywords. \
+Dont include descriptions of what you are doing, such as this document summarizes. Be as concise as possible. \
+Respond only with JSON matching this schema: {schema} </s>\
+
+JSON: [/INST]
+"""
+TITLE_KEYWORDS_SCHEMA = json.dumps(
+    {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "id": {"type": "integer"},
+                "title": {"type": "string"},
+                "keywords": {"type": "array", "items": {"type": "string"}},
+            },
+            "required": ["id", "title", "keywords"],
+        },
+    }
+)
 NUM_WORKERS = 12
 
 logger = BaseLogger(__name__)
 os.environ["TOKENIZERS_PARALLELISM"] = "true"
 
 
+async def run_limited_jobs(
+    jobs: Sequence[Callable[[], Awaitable]],
+    limiter: AdaptiveConcurrencyLimiter = None,
+    show_progress: bool = False,
+    workers: int = NUM_WORKERS,
+) -> list:
+    """Run job factories under the adaptive limiter when there is one, else with a fixed number of workers."""
+    if limiter is None:
+        return await run_jobs([job() for job in jobs], show_progress=show_progress, workers=workers)
+    return await limiter.run_jobs(jobs, show_progress=show_progress)
+
+
 class CustomTitleExtractor(BaseExtractor):
-    llm: LLMPredictorType = Field(description="The LLM to use for generation.")
+    llm: LLM = Field(description="The LLM to use for generation.")
     prompt: PromptTemplate = Field(
         description="The prompt to extract titles with.",
     )
+    _limiter: AdaptiveConcurrencyLimiter = PrivateAttr(default=None)
 
     def __init__(
         self,
-        llm: LLMPredictorType,
+        llm: LLM,
         prompt: PromptTemplate,
         num_workers: int = NUM_WORKERS,
+        limiter: AdaptiveConcurrencyLimiter = None,
     ):
         super().__init__(
             llm=llm,
             prompt=PromptTemplate(template=prompt),
             num_workers=num_workers,
         )
+        self._limiter = limiter
 
     async def aextract(self, nodes: Sequence[BaseNode]) -> List[Dict]:
-        jobs = [self.llm.apredict(self.prompt, context_str=node.text) for node in nodes]
-        tasks = await run_jobs(jobs, show_progress=self.show_progress)
+        jobs = [partial(self.llm.apredict, self.prompt, context_str=node.text) for node in nodes]
+        tasks = await run_limited_jobs(jobs, self._limiter, show_progress=self.show_progress, workers=self.num_workers)
         return [{"node_title": t.strip(' \t\n\r"')} for t in tasks]
 
 
+class AdaptiveKeywordExtractor(KeywordExtractor):
+    """A keyword extractor whose requests run under an adaptive concurrency limiter."""
+
+    _limiter: AdaptiveConcurrencyLimiter = PrivateAttr(default=None)
+
+    def __init__(self, limiter: AdaptiveConcurrencyLimiter = None, **kwargs):
+        super().__init__(**kwargs)
+        self._limiter = limiter
+
+    async def aextract(self, nodes: Sequence[BaseNode]) -> List[Dict]:
+        jobs = [partial(self._aextract_keywords_from_node, node) for node in nodes]
+        return await run_limited_jobs(jobs, self._limiter, show_progress=self.show_progress, workers=self.num_workers)
+
+
+class TitleKeywordExtractor(BaseExtractor):
+    """
+    Extracts node titles and keywords together from one structured response, packing
+    several short nodes into a single prompt.
+    """
+
+    llm: LLM = Field(description="The LLM to use for generation.")
+    prompt: PromptTemplate = Field(
+        description="The prompt to extract titles and keywords with.",
+    )
+    keywords: int = Field(default=5, description="The number of keywords to extract.")
+    pack_size: int = Field(default=4, description="The maximum number of nodes packed into one prompt.")
+    pack_chars: int = Field(default=2000, description="The maximum number of characters packed into one prompt.")
+    _limiter: AdaptiveConcurrencyLimiter = PrivateAttr(default=None)
+
+    def __init__(
+        self,
+        llm: LLM,
+        prompt: PromptTemplate = TITLE_KEYWORDS_PROMPT,
+        keywords: int = 5,
+        pack_size: int = 4,
+        pack_chars: int = 2000,
+        num_workers: int = NUM_WORKERS,
+        limiter: AdaptiveConcurrencyLimiter = None,
+    ):
+        super().__init__(
+            llm=llm,
+            prompt=PromptTemplate(template=prompt),
+            keywords=keywords,
+            pack_size=pack_size,
+            pack_chars=pack_chars,
+            num_workers=num_workers,
+        )
+        self._limiter = limiter
+
+    async def aextract(self, nodes: Sequence[BaseNode]) -> List[Dict]:
+        jobs = [partial(self._aextract_pack, pack) for pack in self._pack(nodes)]
+        tasks = await run_limited_jobs(jobs, self._limiter, show_progress=self.show_progress, workers=self.num_workers)
+        return [metadata for task in tasks for metadata in task]
+
+    def _pack(self, nodes: Sequence[BaseNode]) -> List[List[BaseNode]]:
+        """Group consecutive nodes into packs bounded by pack_size and pack_chars."""
+        packs, pack, chars = [], [], 0
+        for node in nodes:
+            if pack and (len(pack) == self.pack_size or chars + len(node.text) > self.pack_chars):
+                packs.append(pack)
+                pack, chars = [], 0
+            pack.append(node)
+            chars += len(node.text)
+        if pack:
+            packs.append(pack)
+        return packs
+
+    async def _aextract_pack(self, pack: List[BaseNode]) -> List[Dict]:
+        passages = "\n\n".join(f"[{i}] {node.text}" for i, node in enumerate(pack))
+        response = await self.llm.apredict(
+            self.prompt,
+            context_str=passages,
+            keywords=self.keywords,
+            schema=TITLE_KEYWORDS_SCHEMA,
+        )
+        items = self._parse(response)
+        if len(pack) > 1 and any(i not in items for i in range(len(pack))):
+            # a packed response that lost passages falls back to one prompt per passage
+            return [metadata for node in pack for metadata in await self._aextract_pack([node])]
+        return [
+            {
+                "node_title": str(items.get(i, {}).get("title", "")).strip(' \t\n\r"'),
+                "excerpt_keywords": ", ".join(str(k) for k in items.get(i, {}).get("keywords", [])),
+            }
+            for i in range(len(pack))
+        ]
+
+    @staticmethod
+    def _parse(response: str) -> Dict[int, Dict]:
+        """Parse the JSON array of the response into items keyed by passage id."""
+        try:
+            items = json.loads(response[response.index("[") : response.rindex("]") + 1])
+        except ValueError:
+            logger.warning(f"Failed to parse title and keywords from: {response}")
+            return {}
+        return {item["id"]: item for item in items if isinstance(item, dict) and isinstance(item.get("id"), int)}
+
+
 class Pipeline:
     def __init__(
         self,
-        llm: LLMPredictorType = None,
+        llm: LLM = None,
         embed_model: HuggingFaceEmbedding = None,
         prompt: PromptTemplate = SUMMARIZATION_PROMPT,
         chunk_size: int = 512,
@@ -65,51 +210,126 @@ class Pipeline:
         keywords: int = 5,
         storage: Storage = None,
         num_workers: int = NUM_WORKERS,
+        combine_extractors: bool = True,
+        embed_batch_size: int = None,
+        embedding_cache: EmbeddingCache = None,
+        entity_device: str = None,
+        dedup_threshold: float = 0.8,
+        cache_transformations: bool = True,
     ):
         self.num_workers = num_workers
+        self.limiter = AdaptiveConcurrencyLimiter(initial_limit=num_workers)
+        entity_device = entity_device or ("cuda" if torch.cuda.is_available() else "cpu")
+        if entity_device == "cpu":
+            entity_extractor = CPUEntityExtractor(
+                prediction_threshold=prediction_threshold,
+                label_entities=label_entities,
+                metadata_mode=MetadataMode.LLM,
+            )
+        else:
+            # the llama-index EntityExtractor and its span_marker dependency are only needed on gpu hosts
+            from llama_index.extractors.entity import EntityExtractor
+
+            entity_extractor = EntityExtractor(
+                prediction_threshold=prediction_threshold,
+                label_entities=label_entities,
+                device=entity_device,
+                num_workers=self.num_workers,
+                metadata_mode=MetadataMode.LLM,
+            )
+        logger.info(f"Extracting entities on {entity_device}")
+        self.dedup = NearDuplicateFilter(persist_path=os.path.join(PERSIST_DIR, "dedup.db"), threshold=dedup_threshold)
         self.transformations = [
             SentenceSplitter(
                 chunk_size=chunk_size,
                 chunk_overlap=chunk_overlap,
             ),
-            EntityExtractor(
-                prediction_threshold=prediction_threshold,
-                label_entities=label_entities,
-                device="cuda",
-                num_workers=self.num_workers,
-            ),
-            KeywordExtractor(keywords=keywords, llm=llm, num_workers=self.num_workers),
-            CustomTitleExtractor(
-                llm=llm,
-                prompt=prompt,
-                num_workers=self.num_workers,
-            ),
+            self.dedup,
+            entity_extractor,
         ]
+        if combine_extractors:
+            title_keyword_extractor = TitleKeywordExtractor(llm=llm, keywords=keywords, num_workers=self.num_workers, limiter=self.limiter)
+            self.transformations.append(title_keyword_extractor)
+            self.llm_calls_per_node = 1 / title_keyword_extractor.pack_size
+        else:
+            self.transformations += [
+                AdaptiveKeywordExtractor(
+                    keywords=keywords,
+                    llm=llm,
+                    num_workers=self.num_workers,
+                    limiter=self.limiter,
+                    metadata_mode=MetadataMode.LLM,
+                ),
+                CustomTitleExtractor(
+                    llm=llm,
+                    prompt=prompt,
+                    num_workers=self.num_workers,
+                    limiter=self.limiter,
+                ),
+            ]
+            self.llm_calls_per_node = 2
         self.storage = storage
         self.embed_model = embed_model
+        self.embed_batch_size = embed_batch_size or embed_model.embed_batch_size
+        self.embedding_cache = embedding_cache or EmbeddingCache(os.path.join(PERSIST_DIR, "embeddings.db"))
+        self.cache_transformations = cache_transformations
         self.__setup_pipeline()
 
     async def run(
         self,
         documents: List[Document],
+        persist: bool = True,
     ) -> List[TextNode]:
+        duplicates = self.dedup.stats["duplicates"]
         nodes = await self._extract_metadata(documents=documents)
         nodes = self._extract_embeddings(nodes)
-        self.pipeline.persist(PERSIST_DIR)
+        if persist:
+            self.persist()
         logger.info(f"Ingested {len(nodes)} nodes")
+        duplicates = self.dedup.stats["duplicates"] - duplicates
+        logger.info(
+            f"Dropped {duplicates} near-duplicate nodes, saving {duplicates} embeddings "
+            f"and about {round(duplicates * self.llm_calls_per_node)} LLM calls"
+        )
+        logger.info(f"LLM concurrency converged on {self.limiter.limit}: {self.limiter.stats}")
         return nodes
 
+    def persist(self) -> None:
+        self.pipeline.persist(PERSIST_DIR)
+
     async def _extract_metadata(self, documents: List[Document], verbose: bool = True) -> List[TextNode]:
-        return await self.pipeline.arun(documents=documents, show_progress=verbose)
+        # the docstore only needs document hashes to skip unchanged documents, their text would grow it with the corpus
+        return await self.pipeline.arun(documents=documents, show_progress=verbose, store_doc_text=False)
 
     def _extract_embeddings(self, nodes: List[TextNode]) -> List[TextNode]:
+        """Embed nodes in batches, reusing cached embeddings of unchanged content."""
         for node in nodes:
             node.metadata["entities"] = ", ".join(node.metadata.get("entities", []))
-            node.embedding = self.embed_model.get_text_embedding(node.get_content(metadata_mode="all"))
+        contents = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        hashes = [hashlib.sha256(c.encode("utf-8")).hexdigest() for c in contents]
+        texts = dict(zip(hashes, contents))
+
+        model_name = self.embed_model.model_name
+        embeddings = self.embedding_cache.get_many(model_name, list(texts))
+        misses = [h for h in texts if h not in embeddings]
+        logger.info(f"Embedding {len(misses)} of {len(texts)} unique chunks, {len(embeddings)} cached")
+        for start in range(0, len(misses), self.embed_batch_size):
+            batch = misses[start : start + self.embed_batch_size]
+            batch_embeddings = dict(zip(batch, self.embed_model.get_text_embedding_batch([texts[h] for h in batch])))
+            self.embedding_cache.put_many(model_name, batch_embeddings)
+            embeddings.update(batch_embeddings)
+
+        for node, content_hash in zip(nodes, hashes):
+            node.embedding = embeddings[content_hash]
         return nodes
 
     def __setup_pipeline(self) -> None:
-        self.pipeline = IngestionPipeline(transformations=self.transformations, docstore=self.storage.docstore)
+        # with the transform cache disabled, streaming batches through the pipeline doesn't grow it
+        self.pipeline = IngestionPipeline(
+            transformations=self.transformations,
+            docstore=self.storage.docstore,
+            disable_cache=not self.cache_transformations,
+        )
         try:
             self.pipeline.load(PERSIST_DIR)
         except FileNotFoundError:
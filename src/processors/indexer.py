@@ -1,5 +1,8 @@
 import asyncio
+import os
 
+from src.cache import CompletionCache
+from src.constants import PERSIST_DIR
 from src.processors.extractor import Pipeline
 from src.processors.loaders import PDFLoader
 from src.models.completion import LlamaCPPModelAdapter
@@ -9,10 +12,16 @@ from src.utils.logger import BaseLogger
 
 logger = BaseLogger(__name__)
 
-llm = LlamaCPPModelAdapter().model
+os.makedirs(PERSIST_DIR, exist_ok=True)
+# reruns over the same chunks answer the extractors' prompts from the cache instead of the model
+llm = LlamaCPPModelAdapter(completion_cache=CompletionCache(os.path.join(PERSIST_DIR, "completions.db"))).model
 emb = EmbeddingModelAdapter(batch_size=32, device="cpu").model
 st = Storage(llm=llm, embed_model=emb)
-p = Pipeline(llm=llm, embed_model=emb, storage=st)
+
+
+BATCH_SIZE = 64
+QUEUE_SIZE = 2
+PERSIST_EVERY = 8
 
 
 def load_documents(sample_size=None, randomize=False):
@@ -22,10 +31,54 @@ def load_documents(sample_size=None, randomize=False):
     return documents
 
 
-async def main():
-    documents = load_documents()
-    nodes = await p.run(documents=documents)
-    st.create_vector_index(nodes=nodes)
+async def produce_batches(queue: asyncio.Queue, batch_size: int, sample_size=None, randomize=False):
+    """Parse documents into fixed-size batches, waiting whenever the queue of unprocessed batches is full."""
+    documents = PDFLoader().iter_data(sample_size=sample_size, randomize=randomize)
+    batch = []
+    while (document := await asyncio.to_thread(next, documents, None)) is not None:
+        batch.append(document)
+        if len(batch) == batch_size:
+            await queue.put(batch)
+            batch = []
+    if batch:
+        await queue.put(batch)
+    await queue.put(None)
+
+
+async def consume_batches(queue: asyncio.Queue, p: Pipeline, persist_every: int = PERSIST_EVERY):
+    """
+    Split, extract, embed and upsert each batch, so progress lands in the store batch by batch. The
+    docstore is persisted every persist_every batches rather than rewritten per batch, so that a killed
+    run loses at most that many batches of document hashes and a rerun skips the rest.
+    """
+    n_batches, n_documents, n_nodes = 0, 0, 0
+    while (batch := await queue.get()) is not None:
+        nodes = await p.run(documents=batch, persist=False)
+        st.create_vector_index(nodes=nodes, persist=False)
+        p.dedup.commit()
+        n_batches, n_documents, n_nodes = n_batches + 1, n_documents + len(batch), n_nodes + len(nodes)
+        if n_batches % persist_every == 0:
+            p.persist()
+            st.persist()
+        logger.info(f"Indexed {n_documents} documents into {n_nodes} nodes so far")
+
+
+async def main(streaming: bool = True, batch_size: int = BATCH_SIZE):
+    # the docstore already skips unchanged documents, a transform cache would only grow with each batch
+    p = Pipeline(llm=llm, embed_model=emb, storage=st, cache_transformations=not streaming)
+    if not streaming:
+        documents = load_documents()
+        nodes = await p.run(documents=documents)
+        st.create_vector_index(nodes=nodes)
+        p.dedup.commit()
+        return
+    queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    try:
+        await asyncio.gather(produce_batches(queue, batch_size), consume_batches(queue, p))
+    finally:
+        # persist the docstore of the batches indexed since the last checkpoint, even when the stream fails
+        p.persist()
+        st.persist()
 
 
 if __name__ == "__main__":
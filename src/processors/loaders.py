@@ -1,35 +1,87 @@
 import os
 import random
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterator, List
 
 from llama_index.readers import PDFReader
+from llama_index.schema import Document
 from src.constants import PDF_DIR
 from src.utils.logger import BaseLogger
 
 logger = BaseLogger(__name__)
 
 
+def _read_pdf(file_path: str) -> List[Document]:
+    return PDFReader().load_data(file_path)
+
+
 class PDFLoader:
     """
     A loader for PDF files.
     """
 
-    def __init__(self, source_path: str = PDF_DIR):
+    def __init__(self, source_path: str = PDF_DIR, num_workers: int = os.cpu_count()):
         self._source_path = source_path
         self._files = os.listdir(self._source_path)
         self._loader = PDFReader()
+        self.num_workers = num_workers
 
     def load_data(
         self,
         sample_size: int = None,
         randomize: bool = False,
         random_seed: int = 42,
-    ):
-        documents = [self._loader.load_data(os.path.join(self._source_path, i)) for i in self._files]
-        documents = [c for d in documents for c in d]
+    ) -> List[Document]:
+        documents = list(self.iter_data(sample_size=sample_size, randomize=randomize, random_seed=random_seed))
+        logger.info(f"Loaded {len(documents)} documents")
+        return documents
+
+    def iter_data(
+        self,
+        sample_size: int = None,
+        randomize: bool = False,
+        random_seed: int = 42,
+    ) -> Iterator[Document]:
+        """
+        Yield documents as their files finish parsing. Files are shuffled and sampled
+        before any parsing, so sample_size counts files rather than pages.
+        """
+        files = list(self._files)
         if randomize:
             random.seed(random_seed)
-            random.shuffle(documents)
+            random.shuffle(files)
         if sample_size is not None:
-            documents = documents[:sample_size]
-        logger.info(f"Loaded {len(documents)} documents")
-        return documents
+            files = files[:sample_size]
+        paths = [os.path.join(self._source_path, f) for f in files]
+
+        if self.num_workers <= 1:
+            for path in paths:
+                try:
+                    documents = self._loader.load_data(path)
+                except Exception as e:
+                    logger.error(f"Failed to parse {path}: {e}")
+                    continue
+                yield from documents
+            return
+
+        with ProcessPoolExecutor(max_workers=self.num_workers) as pool:
+            # keep at most two files per worker in flight, so unconsumed documents don't pile up
+            pending = {}
+            for path in paths:
+                pending[pool.submit(_read_pdf, path)] = path
+                if len(pending) >= 2 * self.num_workers:
+                    yield from self._drain(pending)
+            while pending:
+                yield from self._drain(pending)
+
+    def _drain(self, pending: dict) -> Iterator[Document]:
+        """Wait for at least one pending file and yield its documents."""
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            path = pending.pop(future)
+            try:
+                documents = future.result()
+            except Exception as e:
+                logger.error(f"Failed to parse {path}: {e}")
+                continue
+            yield from documents
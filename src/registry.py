@@ -0,0 +1,114 @@
+"""
+A process-wide registry of models, storage and indexes, shared across chat sessions.
+"""
+
+import os
+from threading import RLock
+
+from llama_index.core.indices.vector_store import VectorStoreIndex
+from llama_index.core.llms import LLM
+from llama_index.core.storage.chat_store import SimpleChatStore
+from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+from src.cache import CompletionCache, SemanticCache
+from src.constants import MISTRAL_MODEL_PATH, PERSIST_DIR, VECTOR_QUANTIZATION
+from src.models.completion import LlamaCPPModelAdapter
+from src.models.embeddings import EmbeddingModelAdapter
+from src.storage import AppendOnlyChatStore, Storage
+from src.utils.logger import BaseLogger
+
+logger = BaseLogger(__name__)
+
+
+class Registry:
+    """
+    Loads each model, storage and index once per process and hands out shared handles.
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self._llms = {}
+        self._embed_models = {}
+        self._storages = {}
+        self._indexes = {}
+        self._chat_store = None
+        self._response_cache = None
+        self._completion_cache = None
+
+    def get_llm(self, model_path: str = MISTRAL_MODEL_PATH) -> LLM:
+        with self._lock:
+            if model_path not in self._llms:
+                logger.info(f"Loading llm: {model_path}")
+                adapter = LlamaCPPModelAdapter(model_path, completion_cache=self.get_completion_cache())
+                self._llms[model_path] = adapter.model
+            return self._llms[model_path]
+
+    def get_completion_cache(self) -> CompletionCache:
+        with self._lock:
+            if self._completion_cache is None:
+                os.makedirs(PERSIST_DIR, exist_ok=True)
+                self._completion_cache = CompletionCache(os.path.join(PERSIST_DIR, "completions.db"))
+            return self._completion_cache
+
+    def get_embed_model(self, model_name: str = "BAAI/bge-small-en", device: str = "cuda") -> HuggingFaceEmbedding:
+        key = (model_name, device)
+        with self._lock:
+            if key not in self._embed_models:
+                logger.info(f"Loading embedding model: {model_name} on {device}")
+                self._embed_models[key] = EmbeddingModelAdapter(model_name=model_name, device=device).model
+            return self._embed_models[key]
+
+    def get_storage(self, collection_name: str = "research") -> Storage:
+        with self._lock:
+            if collection_name not in self._storages:
+                self._storages[collection_name] = Storage(
+                    collection_name=collection_name,
+                    llm=self.get_llm(),
+                    embed_model=self.get_embed_model(),
+                    quantization=VECTOR_QUANTIZATION,
+                )
+            return self._storages[collection_name]
+
+    def get_index(self, index_name: str = "research") -> VectorStoreIndex:
+        """Load the appropriate index based on the index_name, building it only once."""
+        with self._lock:
+            if index_name not in self._indexes:
+                logger.info(f"Loading index: {index_name}")
+                storage = self.get_storage()
+                if index_name == "research":
+                    self._indexes[index_name] = storage.load_research_index()
+                else:
+                    self._indexes[index_name] = storage.load_vector_index()
+            return self._indexes[index_name]
+
+    def get_chat_store(self) -> AppendOnlyChatStore:
+        with self._lock:
+            if self._chat_store is None:
+                self._chat_store = AppendOnlyChatStore(persist_dir=f"{PERSIST_DIR}/chats")
+                self._migrate_chat_store(f"{PERSIST_DIR}/chat_store.json")
+            return self._chat_store
+
+    def _migrate_chat_store(self, persist_path: str) -> None:
+        """Move histories from the legacy single-file chat store into the per-key logs."""
+        if not os.path.exists(persist_path):
+            return
+        try:
+            legacy = SimpleChatStore.from_persist_path(persist_path=persist_path)
+        except Exception as e:
+            logger.warning(f"Error loading chat store: {e}")
+            return
+        for key in legacy.get_keys():
+            if not self._chat_store.get_messages(key):
+                self._chat_store.set_messages(key, legacy.get_messages(key))
+                self._chat_store.persist(key)
+        os.replace(persist_path, f"{persist_path}.migrated")
+        logger.info(f"Migrated {len(legacy.get_keys())} chat histories from {persist_path}")
+
+    def get_response_cache(self) -> SemanticCache:
+        with self._lock:
+            if self._response_cache is None:
+                self._response_cache = SemanticCache(embed_model=self.get_embed_model())
+            return self._response_cache
+
+
+registry = Registry()
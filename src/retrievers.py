@@ -0,0 +1,147 @@
+"""
+Sparse and hybrid retrieval over the Storage collections.
+"""
+
+import asyncio
+import math
+import re
+import sqlite3
+from collections import Counter
+from threading import Lock
+from typing import List, Sequence
+
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import BaseNode, MetadataMode, NodeWithScore, QueryBundle
+from llama_index.core.vector_stores.types import BasePydanticVectorStore
+
+from src.utils.logger import BaseLogger
+
+logger = BaseLogger(__name__)
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were which with we our".split()
+)
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[\-\.][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens, keeping hyphenated and dotted names such as gpt-4o or llama-3.1 intact."""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class SparseIndex:
+    """
+    A BM25 inverted index over node texts, persisted in SQLite so that it updates incrementally.
+    """
+
+    def __init__(self, persist_path: str, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = Lock()
+        self._conn = sqlite3.connect(persist_path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS docs (node_id TEXT PRIMARY KEY, length INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                node_id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, node_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_node_id ON postings (node_id);
+            """
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def add(self, nodes: Sequence[BaseNode]) -> None:
+        """Index nodes, replacing any earlier version of the same node ids."""
+        self.delete([n.node_id for n in nodes])
+        with self._lock, self._conn:
+            for node in nodes:
+                terms = Counter(tokenize(node.get_content(metadata_mode=MetadataMode.EMBED)))
+                self._conn.execute("INSERT INTO docs VALUES (?, ?)", (node.node_id, sum(terms.values())))
+                self._conn.executemany(
+                    "INSERT INTO postings VALUES (?, ?, ?)",
+                    [(term, node.node_id, tf) for term, tf in terms.items()],
+                )
+
+    def delete(self, node_ids: Sequence[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM docs WHERE node_id = ?", [(i,) for i in node_ids])
+            self._conn.executemany("DELETE FROM postings WHERE node_id = ?", [(i,) for i in node_ids])
+
+    def query(self, query_str: str, top_k: int = 5) -> List[tuple[str, float]]:
+        """Return the top_k (node_id, bm25 score) pairs for a query."""
+        with self._lock:
+            n_docs, avg_length = self._conn.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+            if not n_docs:
+                return []
+            scores = Counter()
+            for term in set(tokenize(query_str)):
+                rows = self._conn.execute(
+                    "SELECT p.node_id, p.tf, d.length FROM postings p JOIN docs d USING (node_id) WHERE p.term = ?",
+                    (term,),
+                ).fetchall()
+                if not rows:
+                    continue
+                idf = math.log(1 + (n_docs - len(rows) + 0.5) / (len(rows) + 0.5))
+                for node_id, tf, length in rows:
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[node_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores.most_common(top_k)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Fuses dense retrieval from the vector store with sparse BM25 retrieval using reciprocal rank fusion.
+    """
+
+    def __init__(
+        self,
+        dense_retriever: BaseRetriever,
+        sparse_index: SparseIndex,
+        vector_store: BasePydanticVectorStore,
+        sparse_top_k: int = 4,
+        top_k: int = 2,
+        rrf_k: int = 60,
+        **kwargs,
+    ):
+        self._dense_retriever = dense_retriever
+        self._sparse_index = sparse_index
+        self._vector_store = vector_store
+        self._sparse_top_k = sparse_top_k
+        self._top_k = top_k
+        self._rrf_k = rrf_k
+        super().__init__(**kwargs)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        dense = self._dense_retriever.retrieve(query_bundle)
+        sparse = self._sparse_index.query(query_bundle.query_str, top_k=self._sparse_top_k)
+        return self._fuse(dense, sparse)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        # the query embedding and chroma query are synchronous under aretrieve, so both run in threads
+        dense, sparse = await asyncio.gather(
+            asyncio.to_thread(self._dense_retriever.retrieve, query_bundle),
+            asyncio.to_thread(self._sparse_index.query, query_bundle.query_str, self._sparse_top_k),
+        )
+        return await asyncio.to_thread(self._fuse, dense, sparse)
+
+    def _fuse(self, dense: List[NodeWithScore], sparse: List[tuple[str, float]]) -> List[NodeWithScore]:
+        """Reciprocal rank fusion, fetching sparse-only hits from the vector store."""
+        scores = Counter()
+        for rank, result in enumerate(dense):
+            scores[result.node.node_id] += 1 / (self._rrf_k + rank + 1)
+        for rank, (node_id, _) in enumerate(sparse):
+            scores[node_id] += 1 / (self._rrf_k + rank + 1)
+
+        fused = scores.most_common(self._top_k)
+        nodes = {result.node.node_id: result.node for result in dense}
+        missing = [node_id for node_id, _ in fused if node_id not in nodes]
+        if missing:
+            nodes.update({node.node_id: node for node in self._vector_store.get_nodes(node_ids=missing)})
+        return [NodeWithScore(node=nodes[node_id], score=score) for node_id, score in fused if node_id in nodes]
@@ -1,15 +1,28 @@
+import json
+import os
+from collections import defaultdict
+from threading import Lock
+from typing import List, Optional
+from urllib.parse import quote, unquote
+
 from chromadb import PersistentClient
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 
 from llama_index.core import Settings
 from llama_index.core import SimpleDirectoryReader
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
 from llama_index.core.indices.vector_store import VectorStoreIndex
-from llama_index.core.llms import LLM
+from llama_index.core.llms import LLM, ChatMessage
 from llama_index.core.schema import TextNode
+from llama_index.core.storage.chat_store import BaseChatStore
 from llama_index.core.storage.docstore import SimpleDocumentStore
 from llama_index.core.storage.storage_context import StorageContext
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
 from llama_index.vector_stores.chroma import ChromaVectorStore
 
+from src.retrievers import HybridRetriever, SparseIndex
+from src.vector_stores import QuantizedChromaVectorStore
+from src.utils.incremental import Manifest
 from src.utils.logger import BaseLogger
 from src.constants import PERSIST_DIR, RESEARCH_DIR
 
@@ -24,17 +37,27 @@ class Storage:
         collection_name: str = "research",
         llm: LLM = None,
         embed_model: HuggingFaceEmbedding = None,
+        quantization: str = None,
     ):
         self.persist_directory = persist_directory
+        self.research_directory = research_directory
+        self.manifest_path = os.path.join(self.persist_directory, f"{collection_name}_manifest.json")
         try:
             self.docstore = SimpleDocumentStore.from_persist_dir(persist_dir=self.persist_directory)
         except FileNotFoundError:
             logger.warning("Creating new document store")
             self.docstore = SimpleDocumentStore()
-        self.research_docs = SimpleDirectoryReader(input_dir=research_directory, exclude_hidden=False, recursive=True).load_data()
         self.chroma_client = PersistentClient(path=self.persist_directory)
         self.chroma_collection = self.chroma_client.get_or_create_collection(collection_name)
-        self.vector_store = ChromaVectorStore(chroma_collection=self.chroma_collection)
+        if quantization:
+            self.vector_store = QuantizedChromaVectorStore(
+                chroma_collection=self.chroma_collection,
+                quantization=quantization,
+                persist_dir=os.path.join(self.persist_directory, f"{collection_name}_{quantization}"),
+            )
+        else:
+            self.vector_store = ChromaVectorStore(chroma_collection=self.chroma_collection)
+        self.sparse_index = SparseIndex(os.path.join(self.persist_directory, f"{collection_name}_bm25.db"))
         self.storage_context = StorageContext.from_defaults(
             vector_store=self.vector_store,
             docstore=self.docstore,
@@ -44,15 +67,216 @@ class Storage:
         Settings.chunk_size = 512
         Settings.chunk_overlap = 20
 
-    def create_vector_index(self, nodes: list[TextNode]) -> None:
-        index = VectorStoreIndex(
+    @property
+    def version(self) -> tuple:
+        """
+        The persisted state of the collection, which changes whenever this or another process (e.g. the
+        indexer) writes to it, so that caches keyed on it go stale.
+        """
+        mtimes = []
+        for path in (self.manifest_path, os.path.join(self.persist_directory, "docstore.json")):
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return (self.chroma_collection.count(), *mtimes)
+
+    def create_vector_index(self, nodes: list[TextNode], persist: bool = True) -> None:
+        VectorStoreIndex(
             nodes,
             storage_context=self.storage_context,
         )
-        index.storage_context.persist(persist_dir=self.persist_directory)
+        self.sparse_index.add(nodes)
+        if persist:
+            self.persist()
+
+    def persist(self) -> None:
+        self.storage_context.persist(persist_dir=self.persist_directory)
 
     def load_vector_index(self) -> VectorStoreIndex:
         return VectorStoreIndex.from_vector_store(self.vector_store)
 
+    def hybrid_retriever(
+        self,
+        index: VectorStoreIndex,
+        dense_top_k: int = 2,
+        sparse_top_k: int = 4,
+        top_k: int = 2,
+    ) -> HybridRetriever:
+        """A retriever fusing dense results from the index with sparse BM25 results from the sidecar."""
+        self._backfill_sparse_index()
+        return HybridRetriever(
+            dense_retriever=index.as_retriever(similarity_top_k=dense_top_k),
+            sparse_index=self.sparse_index,
+            vector_store=self.vector_store,
+            sparse_top_k=sparse_top_k,
+            top_k=top_k,
+        )
+
     def load_research_index(self) -> VectorStoreIndex:
-        return VectorStoreIndex.from_documents(self.research_docs, storage_context=self.storage_context)
+        """Sync the collection with the research directory, embedding only new or changed files."""
+        index = self.load_vector_index()
+        manifest = Manifest(self.manifest_path)
+        file_paths = [str(f) for f in self._research_reader().input_files]
+
+        for file_path in manifest.removed(file_paths):
+            logger.info(f"Removing deleted research file: {file_path}")
+            self._delete_nodes(manifest.pop(file_path)["node_ids"])
+
+        for file_path, content_hash in manifest.changed(file_paths).items():
+            entry = manifest.get(file_path)
+            if entry:
+                self._delete_nodes(entry["node_ids"])
+            else:
+                # vectors inserted before the manifest existed are only traceable by path
+                self._delete_nodes(self.chroma_collection.get(where={"file_path": file_path}, include=[])["ids"])
+            logger.info(f"Indexing research file: {file_path}")
+            docs = SimpleDirectoryReader(input_files=[file_path], exclude_hidden=False).load_data()
+            nodes = Settings.node_parser.get_nodes_from_documents(docs)
+            index.insert_nodes(nodes)
+            self.sparse_index.add(nodes)
+            manifest.update(file_path, content_hash, node_ids=[n.node_id for n in nodes])
+
+        manifest.save()
+        return index
+
+    def _delete_nodes(self, node_ids: list[str]) -> None:
+        if not node_ids:
+            return
+        self.vector_store.delete_nodes(node_ids=node_ids)
+        self.sparse_index.delete(node_ids)
+
+    def _backfill_sparse_index(self, batch_size: int = 1000) -> None:
+        """Index nodes that were added to the collection before the sparse index existed."""
+        count = self.chroma_collection.count()
+        if len(self.sparse_index) >= count:
+            return
+        logger.info(f"Backfilling sparse index from {count} vectors")
+        for offset in range(0, count, batch_size):
+            batch = self.chroma_collection.get(limit=batch_size, offset=offset, include=["documents", "metadatas"])
+            nodes = [metadata_dict_to_node(m, text=d) for m, d in zip(batch["metadatas"], batch["documents"])]
+            self.sparse_index.add(nodes)
+
+    def _research_reader(self) -> SimpleDirectoryReader:
+        """A reader that only lists the research files, parsing happens on iteration."""
+        return SimpleDirectoryReader(input_dir=self.research_directory, exclude_hidden=False, recursive=True)
+
+
+class AppendOnlyChatStore(BaseChatStore):
+    """
+    A chat store that keeps one append-only log per chat store key.
+
+    Persisting a key appends only the messages added since its last persist, histories that
+    were rewritten (e.g. summarized by the memory buffer) are logged as a single snapshot, and
+    logs are compacted into one snapshot once they grow past `compact_threshold` records.
+    """
+
+    persist_dir: str = Field(default=f"{PERSIST_DIR}/chats")
+    compact_threshold: int = Field(default=256)
+
+    _store: dict = PrivateAttr(default_factory=dict)
+    _persisted: dict = PrivateAttr(default_factory=dict)
+    _records: dict = PrivateAttr(default_factory=dict)
+    _locks: dict = PrivateAttr(default_factory=lambda: defaultdict(Lock))
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        os.makedirs(self.persist_dir, exist_ok=True)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "AppendOnlyChatStore"
+
+    def set_messages(self, key: str, messages: List[ChatMessage]) -> None:
+        self._load(key)
+        self._store[key] = list(messages)
+
+    def get_messages(self, key: str) -> List[ChatMessage]:
+        return self._load(key)
+
+    def add_message(self, key: str, message: ChatMessage, idx: Optional[int] = None) -> None:
+        messages = self._load(key)
+        if idx is None:
+            messages.append(message)
+        else:
+            messages.insert(idx, message)
+
+    def delete_messages(self, key: str) -> Optional[List[ChatMessage]]:
+        messages = self._load(key)
+        self._store[key] = []
+        return messages or None
+
+    def delete_message(self, key: str, idx: int) -> Optional[ChatMessage]:
+        messages = self._load(key)
+        if idx >= len(messages):
+            return None
+        return messages.pop(idx)
+
+    def delete_last_message(self, key: str) -> Optional[ChatMessage]:
+        messages = self._load(key)
+        return messages.pop() if messages else None
+
+    def get_keys(self) -> List[str]:
+        keys = {unquote(f[: -len(".jsonl")]) for f in os.listdir(self.persist_dir) if f.endswith(".jsonl")}
+        return sorted(keys | set(self._store))
+
+    def persist(self, key: str) -> None:
+        """Write the changes made to a key since its last persist to its log."""
+        with self._locks[key]:
+            messages = list(self._load(key))
+            persisted = self._persisted.get(key, [])
+            if messages[: len(persisted)] == persisted:
+                records = [{"op": "add", "message": m.model_dump(mode="json")} for m in messages[len(persisted) :]]
+            else:
+                records = [{"op": "set", "messages": [m.model_dump(mode="json") for m in messages]}]
+            if records:
+                with open(self._log_path(key), "a") as f:
+                    f.writelines(json.dumps(r) + "\n" for r in records)
+                self._records[key] = self._records.get(key, 0) + len(records)
+            self._persisted[key] = messages
+            if self._records[key] > self.compact_threshold:
+                self._compact(key, messages)
+
+    def _compact(self, key: str, messages: List[ChatMessage]) -> None:
+        """Rewrite a log as a single snapshot of its messages."""
+        log_path = self._log_path(key)
+        tmp_path = f"{log_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps({"op": "set", "messages": [m.model_dump(mode="json") for m in messages]}) + "\n")
+        os.replace(tmp_path, log_path)
+        self._records[key] = 1
+
+    def _load(self, key: str) -> List[ChatMessage]:
+        """Replay a key's log on first access, skipping corrupt records and truncating a torn final one."""
+        if key not in self._store:
+            messages, records, end, torn = [], 0, 0, False
+            try:
+                with open(self._log_path(key), "rb") as f:
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            torn = True
+                            break
+                        end += len(line)
+                        try:
+                            record = json.loads(line)
+                        except json.JSONDecodeError:
+                            logger.warning(f"Skipping corrupt chat log record for key: {key}")
+                            continue
+                        if record["op"] == "add":
+                            messages.append(ChatMessage.model_validate(record["message"]))
+                        else:
+                            messages = [ChatMessage.model_validate(m) for m in record["messages"]]
+                        records += 1
+            except FileNotFoundError:
+                pass
+            if torn:
+                # cut off the torn write, so that the next append starts on its own line
+                logger.warning(f"Truncating torn chat log record for key: {key}")
+                os.truncate(self._log_path(key), end)
+            self._store[key] = messages
+            self._persisted[key] = list(messages)
+            self._records[key] = records
+        return self._store[key]
+
+    def _log_path(self, key: str) -> str:
+        return os.path.join(self.persist_dir, f"{quote(key or 'default', safe='')}.jsonl")
@@ -0,0 +1,248 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from threading import Lock
+from typing import AsyncIterator, Awaitable, Callable, Sequence
+from weakref import WeakKeyDictionary
+
+import httpx
+import numpy as np
+
+from tqdm.asyncio import tqdm_asyncio
+
+from src.utils.logger import BaseLogger
+
+logger = BaseLogger(__name__)
+
+_semaphores = {}
+_lock = Lock()
+
+
+def backend_semaphore(backend: str, limit: int) -> asyncio.Semaphore:
+    """
+    The semaphore bounding concurrent requests to a backend from the running loop, created on first use.
+    A semaphore can't be shared across event loops, so each loop gets its own, all with the backend's limit.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        backend_limit, semaphores = _semaphores.setdefault(backend, (limit, WeakKeyDictionary()))
+        if limit != backend_limit:
+            raise ValueError(f"Backend {backend} is limited to {backend_limit} concurrent requests, not {limit}.")
+        if loop not in semaphores:
+            semaphores[loop] = asyncio.Semaphore(limit)
+        return semaphores[loop]
+
+
+class LoopLocalTransport(httpx.AsyncBaseTransport):
+    """
+    An async http transport keeping a connection pool per running loop, created on first use. Pooled
+    connections belong to the loop that opened them, so a client shared across loops, such as one per
+    host reused by successive asyncio.run calls, would otherwise hand a new loop connections of a closed one.
+    """
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._transports = WeakKeyDictionary()
+        self._lock = Lock()
+
+    def _transport(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._transports:
+                self._transports[loop] = httpx.AsyncHTTPTransport(**self._kwargs)
+            return self._transports[loop]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._transport().handle_async_request(request)
+
+    async def aclose(self) -> None:
+        with self._lock:
+            transport = self._transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+
+class QueueMetrics:
+    """
+    Queue wait and service times of the most recent requests to a backend.
+    """
+
+    def __init__(self, window: int = 1024):
+        self.requests = 0
+        self.waiting = 0
+        self.in_flight = 0
+        self._queue_times = deque(maxlen=window)
+        self._service_times = deque(maxlen=window)
+
+    @property
+    def stats(self) -> dict:
+        queue_times, service_times = np.array(self._queue_times), np.array(self._service_times)
+        return {
+            "requests": self.requests,
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "queue_p50": float(np.percentile(queue_times, 50)) if len(queue_times) else 0.0,
+            "queue_p95": float(np.percentile(queue_times, 95)) if len(queue_times) else 0.0,
+            "service_p50": float(np.percentile(service_times, 50)) if len(service_times) else 0.0,
+        }
+
+    @asynccontextmanager
+    async def track(self, semaphore: asyncio.Semaphore) -> AsyncIterator[None]:
+        """Hold the semaphore for a request, recording how long it queued for it and how long it held it."""
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        started = time.perf_counter()
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            semaphore.release()
+            self.in_flight -= 1
+            self.requests += 1
+            self._queue_times.append(started - queued)
+            self._service_times.append(time.perf_counter() - started)
+
+
+_metrics = {}
+
+
+def backend_metrics(backend: str) -> QueueMetrics:
+    """The process-wide queue metrics of a backend, created on first use."""
+    with _lock:
+        if backend not in _metrics:
+            _metrics[backend] = QueueMetrics()
+        return _metrics[backend]
+
+
+def _is_overloaded(error: Exception) -> bool:
+    """Whether an error signals an overloaded backend, i.e. its HTTP status is 429 or 503."""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status in (429, 503)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    An AIMD concurrency limiter for LLM requests.
+
+    The limit grows by one after every window of completions whose throughput improved on the
+    last window, and is cut by `backoff` on latency spikes above `latency_tolerance` times the
+    baseline latency or on 429/503 errors, which are retried.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        backoff: float = 0.5,
+        latency_tolerance: float = 2.0,
+        max_retries: int = 5,
+    ):
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.max_retries = max_retries
+        self.completed = 0
+        self.baseline_latency = None
+        self._latency = None
+        self._throughput = 0.0
+        self._in_flight = 0
+        self._window_start = time.monotonic()
+        self._window_completed = 0
+        self._last_decrease = 0.0
+        self._condition = None
+        self._loop = None
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self._in_flight,
+            "completed": self.completed,
+            "throughput": self._throughput,
+            "latency": self._latency,
+        }
+
+    async def run_jobs(
+        self,
+        jobs: Sequence[Callable[[], Awaitable]],
+        show_progress: bool = False,
+        desc: str = None,
+    ) -> list:
+        """Run job factories under the adaptive limit, returning their results in order."""
+        tasks = [self._run(job) for job in jobs]
+        if show_progress:
+            return await tqdm_asyncio.gather(*tasks, desc=desc)
+        return await asyncio.gather(*tasks)
+
+    async def _run(self, job: Callable[[], Awaitable]):
+        for attempt in range(self.max_retries + 1):
+            await self._acquire()
+            start = time.monotonic()
+            try:
+                result = await job()
+            except Exception as e:
+                await self._release()
+                if not _is_overloaded(e) or attempt == self.max_retries:
+                    raise
+                self._decrease(f"backend overloaded: {e}")
+                await asyncio.sleep(min(2**attempt, 30))
+                continue
+            await self._release()
+            self._record(time.monotonic() - start)
+            return result
+
+    async def _acquire(self) -> None:
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+    async def _release(self) -> None:
+        condition = self._get_condition()
+        async with condition:
+            self._in_flight -= 1
+            condition.notify_all()
+
+    def _get_condition(self) -> asyncio.Condition:
+        """A condition bound to the running loop, recreated when the limiter moves to a new loop."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._condition = loop, asyncio.Condition()
+        return self._condition
+
+    def _record(self, latency: float) -> None:
+        self.completed += 1
+        self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+        self.baseline_latency = min(self.baseline_latency or self._latency, self._latency)
+        if latency > self.latency_tolerance * self.baseline_latency:
+            self._decrease(f"latency spike: {latency:.2f}s against a {self.baseline_latency:.2f}s baseline")
+            return
+
+        self._window_completed += 1
+        if self._window_completed < self.limit:
+            return
+        now = time.monotonic()
+        throughput = self._window_completed / (now - self._window_start)
+        if throughput > self._throughput and self.limit < self.max_limit:
+            self.limit += 1
+        self._throughput = throughput
+        self._window_start, self._window_completed = now, 0
+
+    def _decrease(self, reason: str) -> None:
+        """Cut the limit, at most once per baseline latency so a burst of slow responses counts once."""
+        now = time.monotonic()
+        if now - self._last_decrease < (self.baseline_latency or 1.0):
+            return
+        self.limit = max(self.min_limit, int(self.limit * self.backoff))
+        self._last_decrease = now
+        self._throughput = 0.0
+        self._window_start, self._window_completed = now, 0
+        logger.warning(f"Reduced concurrency to {self.limit} on {reason}")
@@ -1,23 +1,75 @@
+"""
+Change detection for pipelines that should only reprocess new or changed files.
+"""
+
+import hashlib
+import json
 import os
-from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+
+def hash_file(file_path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    A JSON manifest of processed files keyed by path, recording each file's content hash alongside
+    whatever the pipeline derived from it. Files whose size and modification time are unchanged
+    are not rehashed.
+    """
+
+    def __init__(self, persist_path: str):
+        self.persist_path = persist_path
+        try:
+            with open(persist_path, "r") as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+
+    def __contains__(self, file_path: str) -> bool:
+        return file_path in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, file_path: str) -> Optional[dict]:
+        return self.entries.get(file_path)
 
+    def changed(self, file_paths: Iterable[str]) -> Dict[str, str]:
+        """Return the content hashes of the files that are new or changed since they were last recorded."""
+        changed = {}
+        for file_path in file_paths:
+            entry = self.entries.get(file_path)
+            stat = os.stat(file_path)
+            if entry and entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime_ns:
+                continue
+            content_hash = hash_file(file_path)
+            if entry and entry["hash"] == content_hash:
+                # touched but not modified, refresh the stat so it isn't hashed again
+                entry.update(size=stat.st_size, mtime=stat.st_mtime_ns)
+                continue
+            changed[file_path] = content_hash
+        return changed
 
-def get_recently_updated_files(directory):
-    directory = os.path.join(os.getcwd(), directory)
-    files = []
-    for filename in os.listdir(directory):
-        filepath = os.path.join(directory, filename)
-        if os.path.isfile(filepath):
-            # Get the modification time in seconds since the epoch
-            modification_unixtime = os.path.getmtime(filepath)
-            modification_time = datetime.fromtimestamp(modification_unixtime)
+    def removed(self, file_paths: Iterable[str]) -> List[str]:
+        """Return the recorded files that are no longer among the given paths."""
+        return sorted(set(self.entries) - set(file_paths))
 
-    files.sort(key=lambda x: x[1], reverse=True)
-    return files
+    def update(self, file_path: str, content_hash: str, **outputs) -> None:
+        stat = os.stat(file_path)
+        self.entries[file_path] = {"hash": content_hash, "size": stat.st_size, "mtime": stat.st_mtime_ns, **outputs}
 
+    def pop(self, file_path: str) -> Optional[dict]:
+        return self.entries.pop(file_path, None)
 
-# Example usage:
-directory_path = "src/data/.pdfs/"
-recent_files = get_recently_updated_files(directory_path)
-for file, modification_time in recent_files:
-    print(f"File: {file}, Last Modified: {modification_time}")
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.persist_path) or ".", exist_ok=True)
+        tmp_path = f"{self.persist_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.persist_path)
@@ -0,0 +1,347 @@
+"""
+Quantized candidate search over the Chroma collections.
+"""
+
+import json
+import os
+from threading import Lock
+from typing import Any, List, Optional
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import VectorStoreQuery, VectorStoreQueryResult
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+from llama_index.vector_stores.chroma import ChromaVectorStore
+
+from src.utils.logger import BaseLogger
+
+logger = BaseLogger(__name__)
+
+QUANTIZATION_MODES = ("int8", "binary")
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint16)
+
+
+def quantize(embeddings: np.ndarray, mode: str) -> tuple[np.ndarray, np.ndarray]:
+    """Quantize float embeddings to codes, returning the codes and per-vector scales."""
+    embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    if mode == "int8":
+        scales = np.abs(embeddings).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(embeddings / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    if mode == "binary":
+        return np.packbits(embeddings > 0, axis=1), np.ones(len(embeddings), dtype=np.float32)
+    raise ValueError(f"Quantization mode {mode} not supported. Please use one of {QUANTIZATION_MODES}.")
+
+
+class QuantizedIndex:
+    """
+    An index of quantized embeddings used to shortlist candidates, alongside the float16 vectors the
+    shortlist is rescored with.
+
+    When persisted, rows are appended to flat files in persist_dir and deletes are recorded as tombstones,
+    so that adding a batch writes only that batch. The files are rewritten once most of their rows are dead.
+    The codes are read into memory, the rescoring vectors stay on disk and are memory mapped, so that only
+    the rows of a shortlist are paged in. They are kept as float16 rather than float32: half the disk the
+    sidecar adds next to Chroma, at a precision loss far below the differences rescoring ranks on.
+    """
+
+    def __init__(
+        self,
+        mode: str = "int8",
+        chunk_size: int = 4096,
+        persist_dir: Optional[str] = None,
+        vector_dtype: np.dtype = np.float16,
+    ):
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Quantization mode {mode} not supported. Please use one of {QUANTIZATION_MODES}.")
+        self.mode = mode
+        self.chunk_size = chunk_size
+        self.persist_dir = persist_dir
+        self.vector_dtype = np.dtype(vector_dtype)
+        self._reset()
+
+    def _reset(self, dim: Optional[int] = None) -> None:
+        self.dim = dim
+        self.ids = []
+        self.positions = {}
+        self._rows = 0
+        self._codes = None
+        self._scales = np.empty(0, dtype=np.float32)
+        self._alive = np.empty(0, dtype=bool)
+        self._vectors = None
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    @property
+    def nbytes(self) -> int:
+        """The bytes of the quantized codes and scales searched for candidates."""
+        if self._codes is None:
+            return 0
+        return self._codes[: self._rows].nbytes + self._scales[: self._rows].nbytes
+
+    def add(self, ids: List[str], embeddings: np.ndarray) -> None:
+        if not ids:
+            return
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        self.delete([i for i in ids if i in self.positions])
+        codes, scales = quantize(embeddings, self.mode)
+        vectors = embeddings.astype(self.vector_dtype)
+        if self._codes is None:
+            self.dim = embeddings.shape[1]
+            self._codes = np.empty((0, codes.shape[1]), dtype=codes.dtype)
+            self._vectors = np.empty((0, self.dim), dtype=self.vector_dtype)
+
+        start, end = self._rows, self._rows + len(ids)
+        self._reserve(end)
+        self._codes[start:end], self._scales[start:end], self._alive[start:end] = codes, scales, True
+        if self.persist_dir:
+            self._append(ids, codes, scales, vectors)
+        else:
+            self._vectors[start:end] = vectors
+        self.ids.extend(ids)
+        self.positions.update(zip(ids, range(start, end)))
+        self._rows = end
+
+    def delete(self, ids: List[str]) -> None:
+        rows = np.array([self.positions.pop(i) for i in ids if i in self.positions], dtype=np.int64)
+        if not len(rows):
+            return
+        self._alive[rows] = False
+        if self.persist_dir:
+            with open(self._path("deleted.bin"), "ab") as f:
+                f.write(rows.tobytes())
+        if self._rows - len(self.positions) > max(len(self.positions), self.chunk_size):
+            self._compact()
+
+    def clear(self) -> None:
+        self._reset()
+        if self.persist_dir:
+            for name in ("meta.json", "ids.txt", "codes.bin", "scales.bin", "vectors.bin", "deleted.bin"):
+                try:
+                    os.remove(self._path(name))
+                except FileNotFoundError:
+                    pass
+
+    def search(self, query: np.ndarray, top_k: int) -> List[str]:
+        """Return the ids of the top_k candidates by approximate similarity."""
+        if not self.positions:
+            return []
+        scores = np.concatenate([self._score(query, start) for start in range(0, self._rows, self.chunk_size)])
+        scores[~self._alive[: self._rows]] = -np.inf
+        top_k = min(top_k, len(self.positions))
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        return [self.ids[i] for i in candidates[np.argsort(-scores[candidates])]]
+
+    def vectors(self, ids: List[str]) -> np.ndarray:
+        """The float16 rescoring vectors of indexed ids as float32, read from the memory map when persisted."""
+        rows = [self.positions[i] for i in ids]
+        if not self.persist_dir:
+            return self._vectors[rows].astype(np.float32)
+        vectors = np.memmap(self._path("vectors.bin"), dtype=self.vector_dtype, mode="r", shape=(self._rows, self.dim))
+        return vectors[rows].astype(np.float32)
+
+    def _score(self, query: np.ndarray, start: int) -> np.ndarray:
+        codes = self._codes[start : min(start + self.chunk_size, self._rows)]
+        if self.mode == "binary":
+            query_bits = np.packbits(np.asarray(query) > 0)
+            return -POPCOUNT[np.bitwise_xor(codes, query_bits)].sum(axis=1).astype(np.float32)
+        return (codes.astype(np.float32) @ np.asarray(query, dtype=np.float32)) * self._scales[start : start + len(codes)]
+
+    def _reserve(self, rows: int) -> None:
+        """Grow the in-memory buffers geometrically, so that appending batches stays amortized linear."""
+        capacity = len(self._codes)
+        if rows <= capacity:
+            return
+        capacity = max(rows, 2 * capacity, 1024)
+        grow = [(self._codes, "_codes"), (self._scales, "_scales"), (self._alive, "_alive")]
+        if not self.persist_dir:
+            grow.append((self._vectors, "_vectors"))
+        for array, name in grow:
+            resized = np.empty((capacity, *array.shape[1:]), dtype=array.dtype)
+            resized[: self._rows] = array[: self._rows]
+            setattr(self, name, resized)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.persist_dir, name)
+
+    def _append(self, ids: List[str], codes: np.ndarray, scales: np.ndarray, vectors: np.ndarray) -> None:
+        os.makedirs(self.persist_dir, exist_ok=True)
+        if not os.path.exists(self._path("meta.json")):
+            with open(self._path("meta.json"), "w") as f:
+                json.dump({"mode": self.mode, "dim": self.dim, "dtype": self.vector_dtype.name}, f)
+        for name, data in (("codes.bin", codes), ("scales.bin", scales), ("vectors.bin", vectors)):
+            with open(self._path(name), "ab") as f:
+                f.write(np.ascontiguousarray(data).tobytes())
+        # the ids are written last, a batch they don't list was torn and fails the row count check on load
+        with open(self._path("ids.txt"), "a") as f:
+            f.write("".join(f"{i}\n" for i in ids))
+
+    def _compact(self) -> None:
+        """Drop the dead rows, rewriting the persisted files in one pass."""
+        live = np.flatnonzero(self._alive[: self._rows])
+        logger.info(f"Compacting quantized index from {self._rows} to {len(live)} rows")
+        ids, rows, dim = [self.ids[i] for i in live], self._rows, self.dim
+        if self.persist_dir:
+            old_path = self._path("vectors.bin.old")
+            os.replace(self._path("vectors.bin"), old_path)
+            vectors = np.memmap(old_path, dtype=self.vector_dtype, mode="r", shape=(rows, dim))
+        else:
+            vectors = self._vectors
+        self.clear()
+        for start in range(0, len(live), self.chunk_size):
+            self.add(ids[start : start + self.chunk_size], vectors[live[start : start + self.chunk_size]])
+        if self.persist_dir:
+            del vectors
+            os.remove(old_path)
+
+    def load(self) -> bool:
+        """Load the persisted index, returning False when there is none or its files disagree."""
+        if not self.persist_dir or not os.path.exists(self._path("meta.json")):
+            return False
+        with open(self._path("meta.json")) as f:
+            meta = json.load(f)
+        if meta["mode"] != self.mode or meta["dtype"] != self.vector_dtype.name:
+            return False
+        try:
+            with open(self._path("ids.txt")) as f:
+                ids = f.read().splitlines()
+            if self.mode == "binary":
+                codes, width = np.fromfile(self._path("codes.bin"), dtype=np.uint8), (meta["dim"] + 7) // 8
+            else:
+                codes, width = np.fromfile(self._path("codes.bin"), dtype=np.int8), meta["dim"]
+            scales = np.fromfile(self._path("scales.bin"), dtype=np.float32)
+            vector_bytes = os.path.getsize(self._path("vectors.bin"))
+        except FileNotFoundError:
+            return False
+        rows = len(ids)
+        if (len(codes), len(scales), vector_bytes) != (rows * width, rows, rows * meta["dim"] * self.vector_dtype.itemsize):
+            return False
+
+        self._reset(dim=meta["dim"])
+        self._codes, self._scales = codes.reshape(rows, width), scales
+        self._alive = np.ones(rows, dtype=bool)
+        if os.path.exists(self._path("deleted.bin")):
+            self._alive[np.fromfile(self._path("deleted.bin"), dtype=np.int64)] = False
+        self.ids, self._rows = ids, rows
+        self.positions = {ids[i]: i for i in np.flatnonzero(self._alive)}
+        return True
+
+
+def rescore(query: np.ndarray, embeddings: np.ndarray) -> np.ndarray:
+    """Cosine similarities between a query and unquantized embeddings."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    query = np.asarray(query, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query)
+    return embeddings @ query / np.where(norms == 0, 1.0, norms)
+
+
+class QuantizedChromaVectorStore(ChromaVectorStore):
+    """
+    A Chroma vector store that searches quantized codes held in memory and rescores the
+    shortlist with the float16 vectors memory mapped alongside them.
+
+    Chroma remains the store of record for embeddings, text and metadata, but queries only read
+    text and metadata from it, so its float32 HNSW index isn't loaded to serve them. The codes and
+    rescoring vectors are a sidecar persisted next to the collection and rebuilt from it whenever
+    they fall out of sync.
+    """
+
+    _index: QuantizedIndex = PrivateAttr()
+    _oversample: int = PrivateAttr()
+    _synced: bool = PrivateAttr(default=False)
+    _lock: Any = PrivateAttr()
+
+    def __init__(
+        self,
+        chroma_collection: Any,
+        quantization: str = "int8",
+        persist_dir: Optional[str] = None,
+        oversample: int = 4,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(chroma_collection=chroma_collection, **kwargs)
+        self._index = QuantizedIndex(mode=quantization, persist_dir=persist_dir)
+        self._oversample = oversample
+        self._lock = Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "QuantizedChromaVectorStore"
+
+    @property
+    def quantized_index(self) -> QuantizedIndex:
+        self._sync()
+        return self._index
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        # sync against the collection before it grows, so that the loaded sidecar's count still matches
+        self._sync()
+        ids = super().add(nodes, **add_kwargs)
+        with self._lock:
+            self._index.add(ids, np.array([n.get_embedding() for n in nodes], dtype=np.float32))
+        return ids
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        ids = self._collection.get(where={"document_id": ref_doc_id}, include=[])["ids"]
+        super().delete(ref_doc_id, **delete_kwargs)
+        self._delete_codes(ids)
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[Any] = None) -> None:
+        super().delete_nodes(node_ids=node_ids, filters=filters)
+        if filters:
+            # filtered deletes can't be mirrored by id, rebuild from the collection on next use
+            self._synced = False
+        else:
+            self._delete_codes(node_ids or [])
+
+    def clear(self) -> None:
+        super().clear()
+        with self._lock:
+            self._index.clear()
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        """Shortlist candidates on the quantized codes, then rescore them on the float16 vectors."""
+        if not query.query_embedding or query.filters is not None or kwargs:
+            return super().query(query, **kwargs)
+
+        self._sync()
+        with self._lock:
+            candidates = self._index.search(query.query_embedding, query.similarity_top_k * self._oversample)
+            vectors = self._index.vectors(candidates)
+        if not candidates:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+        similarities = rescore(query.query_embedding, vectors)
+        top = np.argsort(-similarities)[: query.similarity_top_k]
+        ids = [candidates[i] for i in top]
+        results = self._collection.get(ids=ids, include=["documents", "metadatas"])
+        records = {i: (document, metadata) for i, document, metadata in zip(results["ids"], results["documents"], results["metadatas"])}
+        nodes = []
+        for node_id in ids:
+            document, metadata = records[node_id]
+            node = metadata_dict_to_node(metadata)
+            node.set_content(document)
+            nodes.append(node)
+        return VectorStoreQueryResult(nodes=nodes, similarities=[float(similarities[i]) for i in top], ids=ids)
+
+    def _delete_codes(self, ids: List[str]) -> None:
+        with self._lock:
+            self._index.delete(ids)
+
+    def _sync(self, batch_size: int = 1000) -> None:
+        """Load the persisted index, rebuilding it from the collection when it is out of sync."""
+        with self._lock:
+            if self._synced:
+                return
+            count = self._collection.count()
+            if self._index.load() and len(self._index) == count:
+                self._synced = True
+                return
+            logger.info(f"Quantizing {count} vectors to {self._index.mode}")
+            self._index.clear()
+            for offset in range(0, count, batch_size):
+                batch = self._collection.get(limit=batch_size, offset=offset, include=["embeddings"])
+                self._index.add(batch["ids"], np.asarray(batch["embeddings"], dtype=np.float32))
+            self._synced = True
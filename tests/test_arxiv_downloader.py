@@ -0,0 +1,90 @@
+import re
+from datetime import datetime, timedelta, timezone
+
+from pipelines.arxiv_downloader import DATE_FORMAT, DailyArxivDownloader
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeArticle:
+    def __init__(self, i: int):
+        self.short_id = f"2401.{i:05d}v1"
+        self.entry_id = f"http://arxiv.org/abs/{self.short_id}"
+        self.title = f"Article {i}"
+        self.published = START + timedelta(hours=i)
+
+    def get_short_id(self):
+        return self.short_id
+
+
+class FakeConnector:
+    """Serves the available articles oldest first, within the query's submitted date range."""
+
+    def __init__(self, n_articles: int):
+        self.articles = [FakeArticle(i) for i in range(n_articles)]
+        self.failing = set()
+        self.queries = []
+        self.downloads = []
+
+    def get_articles_by_topic(self, query, max_results, sort_order=None, download=False):
+        self.queries.append(query)
+        dates = re.search(r"submittedDate:\[(\d+) TO (\d+)\]", query)
+        if dates is None:
+            return self.articles[-max_results:]
+        since, until = (datetime.strptime(d, DATE_FORMAT).replace(tzinfo=timezone.utc) for d in dates.groups())
+        return [a for a in self.articles if since <= a.published <= until][:max_results]
+
+    def download_articles(self, articles):
+        self.downloads.extend(a.short_id for a in articles)
+        return [None if a.short_id in self.failing else f"{a.short_id}.pdf" for a in articles]
+
+
+def downloader(tmp_path, connector):
+    return DailyArxivDownloader(
+        topics="emergence",
+        download_dir=str(tmp_path / "pdfs"),
+        ledger_path=str(tmp_path / "arxiv.db"),
+        max_results=3,
+        connector=connector,
+    )
+
+
+def test_fetch_topic_pages_until_caught_up(tmp_path):
+    connector = FakeConnector(5)
+    dl = downloader(tmp_path, connector)
+    dl.fetch_topic("emergence")
+    assert connector.downloads == [FakeArticle(i).short_id for i in (2, 3, 4)]
+    assert dl.ledger.high_water_mark("emergence") == FakeArticle(4).published
+
+    # the mark advances page by page over the articles submitted since
+    connector.articles += [FakeArticle(i) for i in range(5, 12)]
+    connector.downloads, connector.queries = [], []
+    dl.fetch_topic("emergence")
+    assert connector.downloads == [FakeArticle(i).short_id for i in range(5, 12)]
+    assert len(connector.queries) == 4
+    assert dl.ledger.high_water_mark("emergence") == FakeArticle(11).published
+
+    # paging stops at the last known article, which isn't downloaded again
+    connector.downloads, connector.queries = [], []
+    dl.fetch_topic("emergence")
+    assert connector.downloads == []
+    assert len(connector.queries) == 1
+
+
+def test_fetch_topic_holds_mark_on_failure(tmp_path):
+    connector = FakeConnector(5)
+    dl = downloader(tmp_path, connector)
+    dl.fetch_topic("emergence")
+
+    connector.articles += [FakeArticle(i) for i in range(5, 12)]
+    connector.failing = {FakeArticle(7).short_id}
+    dl.fetch_topic("emergence")
+    # the mark stays before the failed article and paging stops there
+    assert dl.ledger.high_water_mark("emergence") == FakeArticle(6).published
+    assert FakeArticle(9).short_id not in connector.downloads
+
+    # the next run fetches the failed article again
+    connector.failing, connector.downloads = set(), []
+    dl.fetch_topic("emergence")
+    assert connector.downloads[0] == FakeArticle(7).short_id
+    assert dl.ledger.high_water_mark("emergence") == FakeArticle(11).published
@@ -0,0 +1,125 @@
+from typing import List
+
+import pytest
+from llama_index.core import Document
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.extractors import KeywordExtractor
+from llama_index.core.ingestion import IngestionPipeline
+from llama_index.core.llms import MockLLM
+from llama_index.core.node_parser import SentenceSplitter
+
+from cache import CachedLLM, CompletionCache, EmbeddingCache, HTTPCache, SemanticCache
+
+VOCABULARY = ["fleetwood", "mac", "transformers", "attention"]
+
+
+class KeywordEmbedding(BaseEmbedding):
+    """A deterministic bag of words embedding over a tiny vocabulary."""
+
+    def _embed(self, text: str) -> List[float]:
+        return [float(w in text.lower()) for w in VOCABULARY]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+
+class CountingLLM(MockLLM):
+    """A mock LLM counting the completions it generates."""
+
+    calls: int = 0
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs):
+        self.calls += 1
+        return super().complete(prompt, formatted=formatted, **kwargs)
+
+
+@pytest.fixture
+def sample_cache():
+    return SemanticCache(embed_model=KeywordEmbedding(), threshold=0.9)
+
+
+def test_semantic_cache_hit(sample_cache):
+    sample_cache.store(sample_cache.embed("Who is Fleetwood Mac?"), "A rock band.", namespace="casper")
+
+    assert sample_cache.lookup(sample_cache.embed("who's fleetwood mac"), namespace="casper") == "A rock band."
+    assert sample_cache.lookup(sample_cache.embed("How do transformers work?"), namespace="casper") is None
+    assert sample_cache.lookup(sample_cache.embed("Who is Fleetwood Mac?"), namespace="sage") is None
+    assert sample_cache.stats["hits"] == 1
+    assert sample_cache.stats["misses"] == 2
+
+
+def test_semantic_cache_eviction():
+    cache = SemanticCache(embed_model=KeywordEmbedding(), max_size=1)
+    cache.store(cache.embed("Who is Fleetwood Mac?"), "A rock band.", namespace="casper")
+    cache.store(cache.embed("Transformers use attention"), "Attention.", namespace="casper")
+    assert cache.stats["size"] == 1
+    assert cache.lookup(cache.embed("Who is Fleetwood Mac?"), namespace="casper") is None
+
+    cache.invalidate("casper")
+    assert cache.stats["size"] == 0
+
+
+def test_semantic_cache_ttl():
+    cache = SemanticCache(embed_model=KeywordEmbedding(), ttl=0)
+    cache.store(cache.embed("Who is Fleetwood Mac?"), "A rock band.", namespace="casper")
+    assert cache.lookup(cache.embed("Who is Fleetwood Mac?"), namespace="casper") is None
+
+
+def test_embedding_cache(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.db"))
+    cache.put_many("bge-small", {"a": [0.5, 0.25], "b": [1.0, 0.0]})
+
+    response = EmbeddingCache(str(tmp_path / "embeddings.db")).get_many("bge-small", ["a", "c"])
+    assert response == {"a": [0.5, 0.25]}
+    assert cache.get_many("bge-large", ["a"]) == {}
+
+
+def test_http_cache(tmp_path):
+    cache = HTTPCache(str(tmp_path / "http.db"))
+    url = "https://example.com/post"
+    assert cache.get(url) is None
+    assert cache.validators(url) == {}
+
+    cache.put(url, b"<html></html>", etag='"v1"', last_modified="Wed, 21 Oct 2015 07:28:00 GMT")
+    cached = HTTPCache(str(tmp_path / "http.db")).get(url)
+    assert cached.content == b"<html></html>"
+    assert cache.validators(url) == {"If-None-Match": '"v1"', "If-Modified-Since": "Wed, 21 Oct 2015 07:28:00 GMT"}
+
+
+def test_completion_cache(tmp_path):
+    cache = CompletionCache(str(tmp_path / "completions.db"), max_size=2)
+    keys = [CompletionCache.key("mistral", prompt, temperature=0.0) for prompt in ("a", "b", "c")]
+    assert keys[0] != CompletionCache.key("mistral", "a", temperature=0.5)
+
+    cache.put(keys[0], "first")
+    cache.put(keys[1], "second")
+    assert cache.get(keys[0]) == "first"
+    cache.put(keys[2], "third")
+
+    assert cache.get(keys[1]) is None
+    assert CompletionCache(str(tmp_path / "completions.db")).get(keys[2]) == "third"
+    assert cache.stats["hits"] == 1
+    assert cache.stats["size"] == 2
+
+
+def test_cached_llm_pipeline_rerun(tmp_path):
+    llm = CountingLLM()
+    cached = CachedLLM(llm, cache=CompletionCache(str(tmp_path / "completions.db")), model_key="mock")
+    documents = [Document(text="Fleetwood Mac are a rock band. Transformers rely on attention.")]
+
+    def run():
+        # without the pipeline's own transform cache, only the completion cache can spare the model
+        pipeline = IngestionPipeline(transformations=[SentenceSplitter(), KeywordExtractor(llm=cached)], disable_cache=True)
+        return pipeline.run(documents=documents)
+
+    first = run()
+    assert llm.calls == len(first)
+    second = run()
+    assert llm.calls == len(first)
+    assert [n.metadata for n in second] == [n.metadata for n in first]
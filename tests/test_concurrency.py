@@ -0,0 +1,134 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from utils.concurrency import AdaptiveConcurrencyLimiter, LoopLocalTransport, QueueMetrics, backend_semaphore
+
+
+class FakeBackend:
+    """A backend with a fixed number of slots, queueing requests beyond them."""
+
+    def __init__(self, slots: int = 4, latency: float = 0.01):
+        self.slots = asyncio.Semaphore(slots)
+        self.latency = latency
+        self.calls = 0
+
+    async def complete(self, i: int) -> int:
+        self.calls += 1
+        async with self.slots:
+            await asyncio.sleep(self.latency)
+        return i
+
+
+class OverloadedError(Exception):
+    status_code = 429
+
+
+def test_limiter_preserves_order():
+    backend = FakeBackend()
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2)
+    response = asyncio.run(limiter.run_jobs([lambda i=i: backend.complete(i) for i in range(50)]))
+    assert response == list(range(50))
+    assert limiter.stats["completed"] == 50
+
+
+def test_limiter_converges():
+    backend = FakeBackend(slots=4)
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1, max_limit=32)
+    asyncio.run(limiter.run_jobs([lambda i=i: backend.complete(i) for i in range(400)]))
+    assert 2 <= limiter.limit < 32
+
+
+def test_limiter_backs_off_on_overload():
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise OverloadedError("429 Too Many Requests")
+        return "ok"
+
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=8)
+    assert asyncio.run(limiter.run_jobs([flaky])) == ["ok"]
+    assert limiter.limit == 4
+    assert len(attempts) == 2
+
+
+def test_limiter_raises_other_errors():
+    async def broken():
+        raise ValueError("bad prompt")
+
+    with pytest.raises(ValueError):
+        asyncio.run(AdaptiveConcurrencyLimiter().run_jobs([broken]))
+
+    async def too_long():
+        raise ValueError("prompt of 4290 tokens exceeds the context window of 4096")
+
+    # only the status code signals an overload, not digits in the message
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=8)
+    with pytest.raises(ValueError):
+        asyncio.run(limiter.run_jobs([too_long]))
+    assert limiter.limit == 8
+
+
+def test_queue_metrics():
+    metrics = QueueMetrics()
+
+    async def request():
+        async with metrics.track(semaphore):
+            assert metrics.in_flight <= 2
+            await asyncio.sleep(0.02)
+
+    async def main():
+        await asyncio.gather(*[request() for _ in range(6)])
+
+    semaphore = asyncio.Semaphore(2)
+    asyncio.run(main())
+    stats = metrics.stats
+    assert stats["requests"] == 6
+    assert stats["waiting"] == stats["in_flight"] == 0
+    assert stats["queue_p95"] >= 0.03
+
+
+def test_backend_semaphore_per_loop():
+    async def get(limit: int = 2):
+        return backend_semaphore("test-backend", limit)
+
+    first, second = asyncio.run(get()), asyncio.run(get())
+    assert first is not second
+
+    async def same_loop():
+        return await get() is await get()
+
+    assert asyncio.run(same_loop())
+    with pytest.raises(ValueError):
+        asyncio.run(get(limit=3))
+
+
+class OkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+def test_loop_local_transport():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = httpx.AsyncClient(transport=LoopLocalTransport())
+
+    async def get():
+        return (await client.get(f"http://127.0.0.1:{server.server_port}/")).text
+
+    # a keep-alive connection of the first loop isn't reused by the second
+    assert asyncio.run(get()) == asyncio.run(get()) == "ok"
+    server.shutdown()
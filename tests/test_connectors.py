@@ -1,3 +1,4 @@
+import os
 import pytest
 from typing import List
 from arxiv import Result
@@ -51,8 +52,8 @@ def test_arxiv_topic(sample_arxiv_topic):
     logger.info(response[0].title)
 
 
-def test_web_url(sample_web_url):
-    wc = WebConnector()
+def test_web_url(tmp_path, sample_web_url):
+    wc = WebConnector(cache_path=str(tmp_path / "web_cache.db"))
     response = wc.get_articles_by_urls(sample_web_url)
     assert response is not None
     assert isinstance(response, List)
@@ -61,11 +62,79 @@ def test_web_url(sample_web_url):
     logger.info(response[0])
 
 
-def test_web_substack_url(sample_web_substack_url):
-    wc = WebConnector()
+def test_web_substack_url(tmp_path, sample_web_substack_url):
+    wc = WebConnector(cache_path=str(tmp_path / "web_cache.db"))
     response = wc.get_articles_by_urls(sample_web_substack_url)
     assert response is not None
     assert isinstance(response, List)
     assert len(response) > 0
     assert isinstance(response[0], Document)
     logger.info(response[0])
+
+
+class FakeArticle:
+    def __init__(self, short_id: str, failures: int = 0):
+        self.short_id = short_id
+        self.entry_id = f"http://arxiv.org/abs/{short_id}"
+        self.failures = failures
+        self.downloads = 0
+
+    def get_short_id(self):
+        return self.short_id
+
+    def _get_default_filename(self):
+        return f"{self.short_id}.Title.pdf"
+
+    def download_pdf(self, dirpath, filename):
+        self.downloads += 1
+        path = os.path.join(dirpath, filename)
+        with open(path, "wb") as f:
+            f.write(b"%PDF")
+            if self.downloads <= self.failures:
+                raise ConnectionError("connection reset")
+        return path
+
+
+def test_arxiv_download_resumes(tmp_path, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("processors.connectors.time.sleep", sleeps.append)
+    (tmp_path / "2305.18290v3.Title.pdf").write_bytes(b"%PDF\n%%EOF\n")
+    # a truncated file left by an interrupted download is fetched again
+    (tmp_path / "2402.00002v1.Title.pdf").write_bytes(b"%PDF")
+    existing, flaky = FakeArticle("2305.18290v3"), FakeArticle("2401.00001v1", failures=1)
+    truncated, broken = FakeArticle("2402.00002v1"), FakeArticle("2403.00003v1", failures=3)
+
+    ax = ArxivConnector(destination_path=str(tmp_path), download_retries=3)
+    paths = ax.download_articles([existing, flaky, truncated, broken])
+
+    assert existing.downloads == 0
+    assert flaky.downloads == 2
+    assert truncated.downloads == 1
+    assert paths == [
+        str(tmp_path / "2305.18290v3.Title.pdf"),
+        str(tmp_path / "2401.00001v1.Title.pdf"),
+        str(tmp_path / "2402.00002v1.Title.pdf"),
+        None,
+    ]
+    assert not list(tmp_path.glob("*.part"))
+    # no backoff after the last attempt
+    assert sorted(sleeps) == [1, 1, 2]
+
+
+def test_web_parse_uses_site_extractors(tmp_path):
+    from llama_index.readers.web import BeautifulSoupWebReader
+
+    wc = WebConnector(cache_path=str(tmp_path / "web_cache.db"), web_reader=BeautifulSoupWebReader())
+    html = (
+        b"<html><body><h1 class='post-title'>Title</h1><h3 class='subtitle'>Subtitle</h3>"
+        b"<span class='byline-names'>Author</span><div class='available-content'>Body text</div></body></html>"
+    )
+
+    generic = wc._parse(html, "https://example.com/post")
+    assert generic.text == "TitleSubtitleAuthorBody text"
+    assert generic.metadata == {"URL": "https://example.com/post"}
+
+    substack = wc._parse(html, "https://example.com/post", custom_hostname="substack.com")
+    assert substack.text == "Body text"
+    assert substack.metadata["URL"] == "https://example.com/post"
+    assert substack.metadata["Author"] == "Author"
@@ -0,0 +1,45 @@
+import pytest
+from llama_index.core.schema import TextNode
+
+from processors.dedup import MinHasher, NearDuplicateFilter
+
+
+@pytest.fixture
+def sample_text():
+    return (
+        "Proximal policy optimization alternates between sampling data through interaction with the environment "
+        "and optimizing a surrogate objective function using stochastic gradient ascent over several epochs."
+    )
+
+
+def test_minhash_similarity(sample_text):
+    hasher = MinHasher()
+    revised = sample_text.replace("several epochs", "many epochs")
+    unrelated = "Chroma persists embeddings, documents and metadata in a local sqlite database for retrieval."
+    assert MinHasher.similarity(hasher.signature(sample_text), hasher.signature(revised)) > 0.6
+    assert MinHasher.similarity(hasher.signature(sample_text), hasher.signature(unrelated)) < 0.1
+
+
+def test_near_duplicate_filter(tmp_path, sample_text):
+    persist_path = str(tmp_path / "dedup.db")
+    nodes = [
+        TextNode(text=sample_text, metadata={"file_name": "2401.00001v1.pdf"}),
+        TextNode(text=sample_text.upper(), metadata={"file_name": "2401.00001v2.pdf"}),
+        TextNode(text="An unrelated passage about retrieval augmented generation with hybrid search."),
+    ]
+    dedup = NearDuplicateFilter(persist_path=persist_path)
+    kept = dedup(nodes)
+    assert kept == [nodes[0], nodes[2]]
+    assert kept[0].metadata["duplicate_sources"] == "2401.00001v2.pdf"
+    assert "duplicate_sources" in kept[0].excluded_embed_metadata_keys
+    assert dedup.stats["duplicates"] == 1
+
+    # nothing is persisted until the kept nodes are committed after the upsert
+    rerun = NearDuplicateFilter(persist_path=persist_path)
+    assert len(rerun([TextNode(text=sample_text, metadata={"file_name": "2401.00001v3.pdf"})])) == 1
+
+    dedup.commit()
+    rerun = NearDuplicateFilter(persist_path=persist_path)
+    assert rerun([TextNode(text=sample_text, metadata={"file_name": "2401.00001v3.pdf"})]) == []
+    # reindexing a source isn't held back by its own earlier chunks
+    assert len(rerun([TextNode(text=sample_text, metadata={"file_name": "2401.00001v1.pdf"})])) == 1
@@ -0,0 +1,25 @@
+import os
+
+from utils.incremental import Manifest
+
+
+def test_manifest_detects_changes(tmp_path):
+    a, b = tmp_path / "a.pdf", tmp_path / "b.pdf"
+    a.write_bytes(b"first")
+    b.write_bytes(b"second")
+    manifest_path = str(tmp_path / "manifest.json")
+
+    manifest = Manifest(manifest_path)
+    changed = manifest.changed([str(a), str(b)])
+    assert set(changed) == {str(a), str(b)}
+    for file_path, content_hash in changed.items():
+        manifest.update(file_path, content_hash, output=file_path + ".md")
+    manifest.save()
+
+    manifest = Manifest(manifest_path)
+    assert manifest.changed([str(a), str(b)]) == {}
+
+    os.utime(a, ns=(0, 0))
+    b.write_bytes(b"second, revised")
+    assert list(manifest.changed([str(a), str(b)])) == [str(b)]
+    assert manifest.removed([str(b)]) == [str(a)]
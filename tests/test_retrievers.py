@@ -0,0 +1,36 @@
+import pytest
+from llama_index.core.schema import TextNode
+
+from retrievers import SparseIndex, tokenize
+
+
+@pytest.fixture
+def sample_nodes():
+    return [
+        TextNode(id_="dpo", text="Direct Preference Optimization aligns language models without RL."),
+        TextNode(id_="rlhf", text="RLHF trains a reward model and optimizes the policy with PPO."),
+        TextNode(id_="llama", text="Llama-3.1 is an open weights language model."),
+    ]
+
+
+def test_tokenize():
+    assert tokenize("The Llama-3.1 and GPT-4o models") == ["llama-3.1", "gpt-4o", "models"]
+
+
+def test_sparse_index(tmp_path, sample_nodes):
+    si = SparseIndex(str(tmp_path / "bm25.db"))
+    si.add(sample_nodes)
+    assert len(si) == len(sample_nodes)
+
+    response = si.query("llama-3.1 weights", top_k=2)
+    assert response[0][0] == "llama"
+
+    si.delete(["llama"])
+    assert len(si) == len(sample_nodes) - 1
+    assert all(node_id != "llama" for node_id, _ in si.query("llama-3.1 weights"))
+
+
+def test_sparse_index_persistence(tmp_path, sample_nodes):
+    SparseIndex(str(tmp_path / "bm25.db")).add(sample_nodes)
+    response = SparseIndex(str(tmp_path / "bm25.db")).query("PPO reward", top_k=1)
+    assert response[0][0] == "rlhf"
@@ -0,0 +1,73 @@
+import pytest
+from llama_index.core.llms import ChatMessage
+
+from storage import AppendOnlyChatStore
+
+
+@pytest.fixture
+def sample_key():
+    return "@casper"
+
+
+@pytest.fixture
+def sample_messages():
+    return [
+        ChatMessage(role="user", content="Who is Fleetwood Mac?"),
+        ChatMessage(role="assistant", content="A British-American rock band."),
+    ]
+
+
+def test_chat_store_append(tmp_path, sample_key, sample_messages):
+    cs = AppendOnlyChatStore(persist_dir=str(tmp_path))
+    for message in sample_messages:
+        cs.add_message(sample_key, message)
+        cs.persist(sample_key)
+
+    log = (tmp_path / "%40casper.jsonl").read_text().splitlines()
+    assert len(log) == len(sample_messages)
+
+    response = AppendOnlyChatStore(persist_dir=str(tmp_path)).get_messages(sample_key)
+    assert response == sample_messages
+
+
+def test_chat_store_rewrite(tmp_path, sample_key, sample_messages):
+    cs = AppendOnlyChatStore(persist_dir=str(tmp_path))
+    cs.set_messages(sample_key, sample_messages)
+    cs.persist(sample_key)
+    cs.delete_messages(sample_key)
+    cs.set_messages(sample_key, sample_messages[1:])
+    cs.persist(sample_key)
+
+    response = AppendOnlyChatStore(persist_dir=str(tmp_path)).get_messages(sample_key)
+    assert response == sample_messages[1:]
+
+
+def test_chat_store_compaction(tmp_path, sample_key, sample_messages):
+    cs = AppendOnlyChatStore(persist_dir=str(tmp_path), compact_threshold=3)
+    for _ in range(2):
+        for message in sample_messages:
+            cs.add_message(sample_key, message)
+            cs.persist(sample_key)
+
+    log = (tmp_path / "%40casper.jsonl").read_text().splitlines()
+    assert len(log) < 2 * len(sample_messages)
+    assert AppendOnlyChatStore(persist_dir=str(tmp_path)).get_messages(sample_key) == 2 * sample_messages
+    assert cs.get_keys() == [sample_key]
+
+
+def test_chat_store_torn_write(tmp_path, sample_key, sample_messages):
+    cs = AppendOnlyChatStore(persist_dir=str(tmp_path))
+    cs.add_message(sample_key, sample_messages[0])
+    cs.persist(sample_key)
+    with open(tmp_path / "%40casper.jsonl", "a") as f:
+        f.write('{"op": "add", "mess')
+
+    cs = AppendOnlyChatStore(persist_dir=str(tmp_path))
+    assert cs.get_messages(sample_key) == sample_messages[:1]
+    cs.add_message(sample_key, sample_messages[1])
+    cs.persist(sample_key)
+    cs.add_message(sample_key, sample_messages[0])
+    cs.persist(sample_key)
+
+    response = AppendOnlyChatStore(persist_dir=str(tmp_path)).get_messages(sample_key)
+    assert response == [*sample_messages, sample_messages[0]]
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from chromadb import EphemeralClient
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from vector_stores import QuantizedChromaVectorStore, QuantizedIndex, quantize
+
+EMBEDDING_SIZE = 384
+
+
+@pytest.fixture
+def sample_embeddings():
+    return np.random.default_rng(42).normal(size=(100, EMBEDDING_SIZE)).astype(np.float32)
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_quantized_index(mode, sample_embeddings):
+    index = QuantizedIndex(mode=mode)
+    index.add([str(i) for i in range(len(sample_embeddings))], sample_embeddings)
+    assert index.nbytes < sample_embeddings.nbytes / 3
+
+    response = index.search(sample_embeddings[7], top_k=3)
+    assert response[0] == "7"
+
+    index.delete(["7"])
+    assert len(index) == len(sample_embeddings) - 1
+    assert "7" not in index.search(sample_embeddings[7], top_k=3)
+
+
+def test_quantized_index_persistence(tmp_path, sample_embeddings):
+    ids = [str(i) for i in range(len(sample_embeddings))]
+    index = QuantizedIndex(persist_dir=str(tmp_path), chunk_size=16)
+    index.add(ids[:50], sample_embeddings[:50])
+    vector_bytes = (tmp_path / "vectors.bin").stat().st_size
+    index.add(ids[50:], sample_embeddings[50:])
+    # batches are appended rather than rewriting the files
+    assert (tmp_path / "vectors.bin").stat().st_size == 2 * vector_bytes
+    index.delete(["7"])
+
+    reloaded = QuantizedIndex(persist_dir=str(tmp_path), chunk_size=16)
+    assert reloaded.load()
+    assert len(reloaded) == len(sample_embeddings) - 1
+    assert reloaded.search(sample_embeddings[8], top_k=1) == ["8"]
+    assert "7" not in reloaded.search(sample_embeddings[7], top_k=3)
+    np.testing.assert_allclose(reloaded.vectors(["8", "3"]), sample_embeddings[[8, 3]], atol=1e-2)
+
+    # once most rows are dead the files are compacted
+    reloaded.delete(ids[:80])
+    assert reloaded.load() is True and len(reloaded) == 20
+    assert (tmp_path / "vectors.bin").stat().st_size == vector_bytes * 20 // 50
+
+
+def test_quantize_int8(sample_embeddings):
+    codes, scales = quantize(sample_embeddings, "int8")
+    assert codes.dtype == np.int8
+    assert np.abs(codes * scales[:, None] - sample_embeddings).max() < scales.max()
+
+
+def test_quantized_chroma_vector_store(tmp_path, sample_embeddings):
+    collection = EphemeralClient().get_or_create_collection("test_quantized")
+    vs = QuantizedChromaVectorStore(chroma_collection=collection, persist_dir=str(tmp_path / "codes"))
+    nodes = [TextNode(id_=str(i), text=f"node {i}", embedding=e.tolist()) for i, e in enumerate(sample_embeddings)]
+    vs.add(nodes)
+
+    response = vs.query(VectorStoreQuery(query_embedding=sample_embeddings[3].tolist(), similarity_top_k=2))
+    assert response.ids[0] == "3"
+    assert response.nodes[0].get_content() == "node 3"
+    assert response.similarities[0] == pytest.approx(1.0, abs=1e-4)
+
+    vs.delete_nodes(node_ids=["3"])
+    response = vs.query(VectorStoreQuery(query_embedding=sample_embeddings[3].tolist(), similarity_top_k=2))
+    assert "3" not in response.ids
+
+    reloaded = QuantizedChromaVectorStore(chroma_collection=collection, persist_dir=str(tmp_path / "codes"))
+    assert len(reloaded.quantized_index) == len(sample_embeddings) - 1
+
+    # adding in a new process appends to the persisted sidecar instead of requantizing the collection
+    vector_bytes = (tmp_path / "codes" / "vectors.bin").stat().st_size
+    extra = np.random.default_rng(7).normal(size=(10, EMBEDDING_SIZE)).astype(np.float32)
+    restarted = QuantizedChromaVectorStore(chroma_collection=collection, persist_dir=str(tmp_path / "codes"))
+    restarted.add([TextNode(id_=f"extra{i}", text=f"extra {i}", embedding=e.tolist()) for i, e in enumerate(extra)])
+    assert (tmp_path / "codes" / "vectors.bin").stat().st_size == vector_bytes + extra.astype(np.float16).nbytes
+    assert len(restarted.quantized_index) == len(sample_embeddings) + len(extra) - 1